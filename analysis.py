@@ -0,0 +1,202 @@
+import warnings
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import builds
+import buildstore
+import instrument
+import profiler
+
+# Tasks are handed to the workers in chunks of this size, one task is a single target and wave
+chunk_size = 8
+
+# Views of the mapped stores, opened once per worker process. The stores are mapped read-only,
+# so every worker shares the same page cache copy of the build data instead of receiving its own
+fpa_view = None
+epm_view = None
+
+# Profiler of the worker process while the parent is sampled
+sampler = None
+
+
+def open_views(fpa_store, epm_store, instrumented=False, sample_interval=None):
+    # Spans of the parent are not inherited, a worker only sends back the ones of its own tasks,
+    # the same goes for the stacks sampled while the parent is profiled
+    global fpa_view
+    global epm_view
+    global sampler
+    instrument.enabled = instrumented
+    instrument.reset()
+    if sample_interval is not None:
+        sampler = profiler.SamplingProfiler(sample_interval)
+        sampler.start()
+    fpa_view = buildstore.BuildView(fpa_store)
+    epm_view = buildstore.BuildView(epm_store)
+
+
+def update_minutes(first_started, last_finished):
+    # Minutes from the first start to the last finish in milliseconds, for numbers or arrays.
+    # Both are cut to whole seconds first, as the datetimes the minutes were computed from before
+    # (fromtimestamp(ms / 1000)), so the report rounds up exactly like it always did.
+    return np.ceil((last_finished // 1000 - first_started // 1000) / 60.0)
+
+
+def update_time(fpa_builds, fpa_ver, epm_builds, epm_ver, instances):
+    # The update of a wave starts with the first EPM build and ends with the last FPA build
+    with instrument.span('reduce', fpa_version=fpa_ver, epm_version=epm_ver) as span:
+        first_epm = epm_builds.first_started(epm_ver, instances)
+        last_fpa = fpa_builds.last_finished(fpa_ver, instances)
+        span.add(records=len(epm_builds) + len(fpa_builds))
+    minutes = None
+    if first_epm is not None and last_fpa is not None:
+        minutes = int(update_minutes(first_epm, last_fpa))
+    return {
+        'first_started': first_epm,
+        'last_finished': last_fpa,
+        'minutes': minutes,
+    }
+
+
+def analyze_task(task):
+    name, instances, fpa_ver, epm_ver = task
+    result = update_time(fpa_view, fpa_ver, epm_view, epm_ver, instances)
+    result.update({'target': name, 'fpa_version': fpa_ver, 'epm_version': epm_ver})
+    return result, instrument.take(), sampler.take() if sampler is not None else None
+
+
+def analyze(fpa_store, epm_store, targets, waves, processes=None, sampler=None):
+    # targets maps a group or instance name to its instances, waves is a list of
+    # (fpa_version, epm_version) pairs. Every target and wave is analyzed in a process pool
+    # of `processes` workers (all cores by default) and the results are merged into one report
+    # of {fpa_version: {target: result}}. With a profiler.SamplingProfiler as sampler the
+    # workers are sampled at its interval and their stacks are merged into it.
+    tasks = [(name, targets[name], fpa_ver, epm_ver)
+             for (fpa_ver, epm_ver), name in itertools.product(waves, sorted(targets))]
+    report = dict((fpa_ver, {}) for fpa_ver, epm_ver in waves)
+    if not tasks:
+        return report
+
+    # Only the store objects (paths and names) are sent to the workers, each one maps the files itself
+    sample_interval = sampler.interval if sampler is not None else None
+    pool = multiprocessing.Pool(processes, open_views, (fpa_store, epm_store, instrument.enabled, sample_interval))
+    try:
+        for result, spans, samples in pool.imap_unordered(analyze_task, tasks, chunk_size):
+            report[result['fpa_version']][result['target']] = result
+            instrument.merge(spans)
+            if samples is not None:
+                sampler.merge(samples)
+    finally:
+        pool.close()
+        pool.join()
+    return report
+
+
+def wave_windows(table, groups, kind):
+    # Folds the [version, group] windows of a BuildTable into [wave, group] windows, all the
+    # versions of one wave (e.g. EPM patch versions) count as the same update
+    names, first, last, count = table.group_windows(groups)
+    version_wave = [builds.wave_of(version, kind) for version in table.versions]
+    waves = sorted(set(wave for wave in version_wave if wave is not None))
+    wave_codes = dict((wave, code) for code, wave in enumerate(waves))
+    codes = np.array([wave_codes.get(wave, -1) for wave in version_wave], np.int64)
+    keep = codes >= 0
+
+    shape = (len(waves), len(names))
+    wave_first = np.full(shape, np.iinfo(np.int64).max, np.int64)
+    wave_last = np.full(shape, np.iinfo(np.int64).min, np.int64)
+    wave_count = np.zeros(shape, np.int64)
+    np.minimum.at(wave_first, codes[keep], first[keep])
+    np.maximum.at(wave_last, codes[keep], last[keep])
+    np.add.at(wave_count, codes[keep], count[keep])
+    versions = dict((wave, sorted(v for v, w in zip(table.versions, version_wave) if w == wave)) for wave in waves)
+    return waves, names, wave_first, wave_last, wave_count, versions
+
+
+def update_windows(fpa_table, epm_table, groups):
+    # Update windows of every group in every wave at once, arrays are shaped [wave, group].
+    # Only waves with both EPM and FPA builds are returned, minutes is NaN where a group has none.
+    fpa_waves, names, fpa_first, fpa_last, fpa_count, fpa_versions = wave_windows(fpa_table, groups, builds.FPA)
+    epm_waves, names, epm_first, epm_last, epm_count, epm_versions = wave_windows(epm_table, groups, builds.EPM)
+    waves = sorted(set(fpa_waves).intersection(epm_waves))
+    fpa_rows = [fpa_waves.index(wave) for wave in waves]
+    epm_rows = [epm_waves.index(wave) for wave in waves]
+
+    first = epm_first[epm_rows]
+    last = fpa_last[fpa_rows]
+    epm_builds = epm_count[epm_rows]
+    fpa_builds = fpa_count[fpa_rows]
+    minutes = np.full(first.shape, np.nan)
+    found = (epm_builds > 0) & (fpa_builds > 0)
+    minutes[found] = update_minutes(first[found], last[found])
+    versions = dict((wave, {'fpa_versions': fpa_versions[wave], 'epm_versions': epm_versions[wave]})
+                    for wave in waves)
+    return waves, names, first, last, minutes, epm_builds, fpa_builds, versions
+
+
+def trend_statistics(minutes):
+    # Percentiles of the update minutes of every group (column) over the waves it took part in,
+    # plus the trend as the least squares slope in minutes per wave
+    found = ~np.isnan(minutes)
+    waves = found.sum(axis=0)
+    statistics = {'waves': waves}
+    # Groups without any complete wave get NaN instead of a warning
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name, q in (('p50', 50), ('p90', 90), ('p95', 95)):
+            statistics[name] = np.nanpercentile(minutes, q, axis=0) if len(minutes) else np.full(len(waves), np.nan)
+        x = np.arange(len(minutes), dtype=float)[:, None] * found
+        y = np.where(found, minutes, 0)
+        x_mean = x.sum(axis=0) / waves
+        y_mean = y.sum(axis=0) / waves
+        dx = (x - x_mean) * found
+        statistics['mean'] = y_mean
+        statistics['trend'] = (dx * (y - y_mean)).sum(axis=0) / (dx * dx).sum(axis=0)
+    statistics['trend'][waves < 2] = np.nan
+    return statistics
+
+
+def value(number):
+    # JSON friendly scalar, missing values are None
+    if np.isnan(number):
+        return None
+    return float(number)
+
+
+def history_report(fpa_table, epm_table, groups):
+    # Update windows of every group and instance for every wave in the build history, plus
+    # per-group percentiles and trends, from one vectorized pass over each BuildTable.
+    # groups maps a group name to its instances.
+    instances = dict((instance, [instance]) for members in groups.values() for instance in members)
+    report = {'waves': {}, 'groups': {}}
+    for section, targets in (('groups', groups), ('instances', instances)):
+        with instrument.span('reduce', section=section) as span:
+            waves, names, first, last, minutes, epm_builds, fpa_builds, versions = \
+                update_windows(fpa_table, epm_table, targets)
+            span.add(records=len(fpa_table) + len(epm_table))
+        for w, wave in enumerate(waves):
+            windows = report['waves'].setdefault(wave, dict(versions[wave]))
+            windows[section] = {}
+            for g, name in enumerate(names):
+                if not epm_builds[w, g] and not fpa_builds[w, g]:
+                    continue
+                windows[section][name] = {
+                    'first_started': long(first[w, g]) if epm_builds[w, g] else None,
+                    'last_finished': long(last[w, g]) if fpa_builds[w, g] else None,
+                    'minutes': value(minutes[w, g]),
+                    'epm_builds': int(epm_builds[w, g]),
+                    'fpa_builds': int(fpa_builds[w, g]),
+                }
+        if section == 'groups':
+            statistics = trend_statistics(minutes)
+            for g, name in enumerate(names):
+                report['groups'][name] = {
+                    'waves': int(statistics['waves'][g]),
+                    'p50': value(statistics['p50'][g]),
+                    'p90': value(statistics['p90'][g]),
+                    'p95': value(statistics['p95'][g]),
+                    'mean': value(statistics['mean'][g]),
+                    'trend': value(statistics['trend'][g]),
+                }
+    return report
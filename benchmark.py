@@ -0,0 +1,258 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import StringIO
+
+import builds
+import buildstore
+import jenkins
+import instrument
+import getWaveUpdateTime
+
+GROUPS = ['Group1-EU', 'Group1-AP', 'Group1-US', 'Group2-EU', 'Group2-AP', 'Group2-US',
+          'Group3-EU', 'Group3-AP', 'Group3-US']
+
+# A stage fails when it takes more than (1 + tolerance) times its baseline time and at least
+# min_slack seconds longer, so stages of a few milliseconds do not fail on timer noise
+default_tolerance = 0.5
+min_slack = 0.01
+default_baseline = 'benchmark baseline.json'
+
+
+def make_waves(count):
+    # (fpa_version, epm_version) pairs of consecutive weekly waves, newest last
+    waves = []
+    for i in range(count):
+        year, week = 2016 + i // 52, i % 52 + 1
+        waves.append(('%d.%02d' % (year, week), '1.00.%d%02d.%02d' % (year, week, 1 + i % 3)))
+    return waves
+
+
+def make_all_builds(count, job, instances, waves, seed=0):
+    # allBuilds document of a job as Jenkins returns it, newest build first. Builds walk through the
+    # waves in order, every build updates a random instance and a few of the newest still run.
+    rng = random.Random(seed)
+    start = 1483228800000
+    step = 7 * 24 * 3600 * 1000 * len(waves) // max(count, 1)
+    result = []
+    for number in range(count, 0, -1):
+        fpa_version, epm_version = waves[(number - 1) * len(waves) // count]
+        parameters = [
+            {'name': 'INSTANCE', 'value': rng.choice(instances)},
+            {'name': 'SAP_PASSWORD', 'value': '%016x' % rng.getrandbits(64)},
+            {'name': 'HANA_PASSWORD', 'value': '%016x' % rng.getrandbits(64)},
+        ]
+        if job == getWaveUpdateTime.epm_job:
+            parameters.append({'name': 'EPM_VERSION', 'value': epm_version})
+        else:
+            parameters.append({'name': 'FPA_DU_DIR',
+                               'value': '/net/build-drops-wdf/dropzone/orca/EPM_FPA/rel/' + fpa_version})
+        result.append({
+            '_class': 'hudson.model.FreeStyleBuild',
+            'number': number,
+            'timestamp': start + number * step + rng.randrange(step + 1),
+            'duration': 0 if number > count - 3 else rng.randrange(60000, 3600000),
+            'actions': [{'_class': 'hudson.model.CauseAction'},
+                        {'_class': 'hudson.model.ParametersAction', 'parameters': parameters},
+                        {}],
+        })
+    return {'_class': 'hudson.model.FreeStyleProject', 'allBuilds': result}
+
+
+def make_instance_list(instances, seed=0):
+    # getInstanceList payload, every instance in one of the update groups
+    rng = random.Random(seed)
+    return [{'uuid': '%032x' % rng.getrandbits(128),
+             'details': {'name': instance, 'updateGroup': GROUPS[i % len(GROUPS)]}}
+            for i, instance in enumerate(instances)]
+
+
+class Quiet(object):
+    # Swallows the prints of the measured functions
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.stdout
+
+
+def stage_memory(function):
+    # How far the peak resident size rises above the size at the start of one run of the stage.
+    # The run happens in a forked child: the peak of this process is a high-water mark the
+    # synthetic data already reached, the peak of a new child starts at its current size.
+    # None where there is no fork or no peak memory.
+    if not hasattr(os, 'fork') or instrument.peak_memory() is None:
+        return None
+    gc.collect()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        growth = None
+        try:
+            memory = instrument.peak_memory()
+            with Quiet():
+                function()
+            growth = instrument.peak_memory() - memory
+        finally:
+            os.write(write_end, json.dumps(growth))
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as child:
+        growth = json.loads(child.read() or 'null')
+    os.waitpid(pid, 0)
+    return growth
+
+
+def measure(function, repeat):
+    # Best time of `repeat` runs and how much the peak memory grew during one run
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        with Quiet():
+            result = function()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, stage_memory(function), result
+
+
+def run(count, instance_count, wave_count, repeat, work_dir):
+    # Times every pipeline stage on `count` synthetic builds per job, returns {stage: result}
+    instances = ['epmprod%d' % i for i in range(instance_count)]
+    waves = make_waves(wave_count)
+    fpa_version, epm_version = waves[-1]
+    epm_doc = make_all_builds(count, getWaveUpdateTime.epm_job, instances, waves, 1)
+    fpa_doc = make_all_builds(count, getWaveUpdateTime.fpa_job, instances, waves, 2)
+    epm_text = json.dumps(epm_doc)
+    instance_text = json.dumps(make_instance_list(instances))
+    epm_store = buildstore.BuildStore(os.path.join(work_dir, 'epm builds'), builds.EPM)
+    fpa_store = buildstore.BuildStore(os.path.join(work_dir, 'fpa builds'), builds.FPA)
+    state = {}
+
+    def stream_builds():
+        return sum(1 for build in jenkins.iter_builds(StringIO.StringIO(epm_text)))
+
+    def import_builds():
+        return (epm_store.replace(builds.normalize_build(build, builds.EPM) for build in epm_doc['allBuilds']) +
+                fpa_store.replace(builds.normalize_build(build, builds.FPA) for build in fpa_doc['allBuilds']))
+
+    def build_group_info():
+        getWaveUpdateTime.group_info = getWaveUpdateTime.group_instances(json.loads(instance_text), GROUPS)
+        return len(instances)
+
+    def build_index():
+        state['index'] = builds.BuildIndex(epm_store.records())
+        return len(state['index'])
+
+    def group_builds():
+        return sum(len(state['index'].get_group(getWaveUpdateTime.group_info[group], epm_version))
+                   for group in GROUPS)
+
+    def open_view():
+        state['fpa'] = buildstore.BuildView(fpa_store)
+        state['epm'] = buildstore.BuildView(epm_store)
+        return len(state['fpa']) + len(state['epm'])
+
+    def first_started():
+        for group in GROUPS:
+            state['epm'].first_started(epm_version, getWaveUpdateTime.group_info[group])
+        return len(state['epm'])
+
+    def last_finished():
+        for group in GROUPS:
+            state['fpa'].last_finished(fpa_version, getWaveUpdateTime.group_info[group])
+        return len(state['fpa'])
+
+    # Stages run in pipeline order, each one uses what the ones before produced.
+    # A stage returns the number of items it processed, for the throughput.
+    stages = [
+        ('stream_builds', stream_builds),
+        ('import_builds', import_builds),
+        ('build_group_info', build_group_info),
+        ('build_index', build_index),
+        ('group_builds', group_builds),
+        ('open_view', open_view),
+        ('first_started', first_started),
+        ('last_finished', last_finished),
+    ]
+    results = {}
+    for name, function in stages:
+        seconds, memory, items = measure(function, repeat)
+        results[name] = {
+            'seconds': seconds,
+            'items': items,
+            'throughput': items / seconds if seconds > 0 else None,
+            'peak_memory_growth': memory,
+        }
+    state.clear()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns a line for every stage slower than its baseline allows
+    regressions = []
+    for size, stages in sorted(results.items()):
+        for name, result in sorted(stages.items()):
+            expected = baseline.get(size, {}).get(name)
+            if expected is None:
+                continue
+            limit = max(expected['seconds'] * (1 + tolerance), expected['seconds'] + min_slack)
+            if result['seconds'] > limit:
+                regressions.append("{} builds, {}: {:.3f} s, baseline {:.3f} s".format(
+                    size, name, result['seconds'], expected['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the wave update pipeline on synthetic Jenkins and CIC data")
+    parser.add_argument("--builds", type=int, nargs='+', default=[10000, 100000],
+                        help="builds per job, several sizes can be given (default: 10000 100000)")
+    parser.add_argument("--instances", type=int, default=1000, help="number of instances (default: 1000)")
+    parser.add_argument("--waves", type=int, default=52, help="number of waves (default: 52)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one counts (default: 3)")
+    parser.add_argument("--baseline", default=default_baseline, help="baseline file (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+                        help="allowed slow down against the baseline (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='wave-benchmark-')
+    results = {}
+    try:
+        for count in args.builds:
+            results[str(count)] = run(count, args.instances, args.waves, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, True)
+
+    for size, stages in sorted(results.items(), key=lambda item: int(item[0])):
+        print("{} builds per job".format(size))
+        for name, result in sorted(stages.items(), key=lambda item: -item[1]['seconds']):
+            print("  {:<32} {:>9.3f} s {:>12.0f} items/s  peak memory +{} KB".format(
+                name, result['seconds'], result['throughput'] or 0, result['peak_memory_growth']))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline in {}, run with --save-baseline to create one".format(args.baseline))
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for line in regressions:
+        print("REGRESSION " + line)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+EPM = 'epm'
+FPA = 'fpa'
+
+
+def set_instance(record, value):
+    record['instance'] = value
+
+
+def set_epm_version(record, value):
+    record['version'] = value
+
+
+def set_fpa_du_dir(record, value):
+    # The FPA version is the last path segment of the deployment unit directory
+    record['version'] = value[value.rfind('/') + 1:]
+
+
+def wave_of(version, kind):
+    # The FPA version '2017.21' and the EPM version '1.00.201721.01' both belong to wave '201721'.
+    # Returns None for a version that does not follow the naming of its job.
+    parts = version.split('.')
+    if kind == EPM:
+        wave = parts[2] if len(parts) == 4 else ''
+    else:
+        wave = ''.join(parts) if len(parts) == 2 else ''
+    return wave if wave.isdigit() else None
+
+
+# Parameters without a handler (SAP_PASSWORD, HANA_PASSWORD, ...) never make it into a record
+PARAMETER_HANDLERS = {
+    'INSTANCE': set_instance,
+    'EPM_VERSION': set_epm_version,
+    'FPA_DU_DIR': set_fpa_du_dir,
+}
+
+
+def normalize_build(build, kind):
+    record = {
+        'number': build['number'],
+        'timestamp': build['timestamp'],
+        'duration': build['duration'],
+        'instance': None,
+        'version': None,
+        'kind': kind,
+    }
+    for action in build.get('actions', ()):
+        for param in action.get('parameters', ()):
+            handler = PARAMETER_HANDLERS.get(param['name'])
+            if handler is not None:
+                handler(record, param['value'])
+    return record
+
+
+class BuildIndex(object):
+    # Looks up the records of one job by (instance, version) and the instances
+    # that ran a version, without scanning the whole build history
+
+    def __init__(self, records=()):
+        self.by_key = {}
+        self.by_version = {}
+        self.by_number = {}
+        self.invalid = []
+        self.update(records)
+
+    def __len__(self):
+        return len(self.by_number)
+
+    def add(self, record):
+        # A build that was still running comes back with its final duration and replaces the old record
+        old = self.by_number.get(record['number'])
+        if old is not None:
+            self.remove(old)
+        self.by_number[record['number']] = record
+
+        if record['instance'] is None or record['version'] is None:
+            self.invalid.append(record)
+        else:
+            self.by_key.setdefault((record['instance'], record['version']), []).append(record)
+            self.by_version.setdefault(record['version'], set()).add(record['instance'])
+        return record
+
+    def remove(self, record):
+        del self.by_number[record['number']]
+        if record['instance'] is None or record['version'] is None:
+            self.invalid.remove(record)
+            return
+
+        key = (record['instance'], record['version'])
+        self.by_key[key].remove(record)
+        if not self.by_key[key]:
+            del self.by_key[key]
+            self.by_version[record['version']].discard(record['instance'])
+            if not self.by_version[record['version']]:
+                del self.by_version[record['version']]
+
+    def update(self, records):
+        for record in records:
+            self.add(record)
+
+    def instances(self, version):
+        return self.by_version.get(version, set())
+
+    def get(self, instance, version):
+        return list(self.by_key.get((instance, version), ()))
+
+    def get_group(self, instances, version):
+        records = []
+        for instance in self.instances(version).intersection(instances):
+            records.extend(self.by_key[(instance, version)])
+        return records
@@ -0,0 +1,264 @@
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+import instrument
+
+# Every build is one fixed-width record: number, timestamp, duration, instance code, version code.
+# Instance and version names are kept once each in the names file, a code is the line number
+# of the name there and -1 stands for a missing parameter.
+MAGIC = 'WUSB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sII8x')
+RECORD = struct.Struct('<qqqii')
+
+RECORD_DTYPE = np.dtype([('number', '<i8'), ('timestamp', '<i8'), ('duration', '<i8'),
+                         ('instance', '<i4'), ('version', '<i4')])
+
+read_size = RECORD.size * 4096
+
+
+def check_header(header, data_file):
+    magic, version, size = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION or size != RECORD.size:
+        raise IOError("{} is not a build store of format {}".format(data_file, FORMAT_VERSION))
+
+
+class BuildStore(object):
+    # Append-only store of the build records of one job. A build that is fetched again
+    # (because it was still running) is appended again, the last record of a number wins.
+
+    def __init__(self, path, kind):
+        self.data_file = path + '.dat'
+        self.names_file = path + '.names'
+        self.pending_file = path + '.pending'
+        self.kind = kind
+        self.names = []
+        self.codes = {}
+        self.finish_replace()
+        if os.path.exists(self.names_file):
+            with open(self.names_file) as names:
+                for line in names:
+                    self.add_name(json.loads(line))
+
+    def exists(self):
+        return os.path.exists(self.data_file)
+
+    def add_name(self, name):
+        self.codes[name] = len(self.names)
+        self.names.append(name)
+
+    def encode(self, name, names, codes, names_out):
+        if name is None:
+            return -1
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+            names_out.write(json.dumps(name) + '\n')
+            names_out.flush()
+        return codes[name]
+
+    def decode(self, code):
+        return self.names[code] if code >= 0 else None
+
+    def write(self, records, mode, data_file=None, names_file=None, names=None, codes=None):
+        # Names are written before the records that use them, so the data file never
+        # refers to a code that is missing from the names file
+        data_file = data_file or self.data_file
+        names_file = names_file or self.names_file
+        names = self.names if names is None else names
+        codes = self.codes if codes is None else codes
+        count = 0
+        new_file = mode == 'wb' or not os.path.exists(data_file)
+        with open(names_file, 'a') as names_out, open(data_file, mode) as data:
+            if new_file:
+                data.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+            for record in records:
+                data.write(RECORD.pack(record['number'], record['timestamp'], record['duration'],
+                                       self.encode(record['instance'], names, codes, names_out),
+                                       self.encode(record['version'], names, codes, names_out)))
+                count += 1
+        return count
+
+    def append(self, records):
+        # Drop a record cut off by an interrupted append, so new records stay aligned
+        if self.exists():
+            size = os.path.getsize(self.data_file)
+            if size > HEADER.size and (size - HEADER.size) % RECORD.size:
+                with open(self.data_file, 'r+b') as data:
+                    data.truncate(size - (size - HEADER.size) % RECORD.size)
+        return self.write(records, 'ab')
+
+    def sync(self, records, since):
+        # Appends the records fetched from build `since` on, but only once all of them arrived. They
+        # come newest first, appended one by one a failed fetch would leave the older ones missing and
+        # the next sync, starting above the newest stored build, would never fetch them again.
+        # Stored builds from `since` on that are not among them were deleted in Jenkins while running
+        # and are dropped from the store. Returns the number of records written and the numbers of the dropped builds.
+        self.commit_pending()
+        dropped = set(record['number'] for record in self.scan() if record['number'] >= since)
+
+        def fetched():
+            for record in records:
+                dropped.discard(record['number'])
+                yield record
+
+        fetch_file = self.data_file + '.fetch'
+        try:
+            count = self.write(fetched(), 'wb', fetch_file)
+            os.rename(fetch_file, self.pending_file)
+        finally:
+            if os.path.exists(fetch_file):
+                os.remove(fetch_file)
+        self.commit_pending()
+        if dropped:
+            self.replace([record for record in self.records() if record['number'] not in dropped])
+        return count, dropped
+
+    def commit_pending(self):
+        # Appends the records of a complete fetch. The pending file is only removed once they are all
+        # in the store, so a sync interrupted here is finished by the next one. Records appended twice
+        # that way are the same build twice and the last one wins as usual.
+        if not os.path.exists(self.pending_file):
+            return 0
+        count = self.append(self.scan(self.pending_file))
+        os.remove(self.pending_file)
+        return count
+
+    def replace(self, records):
+        # Rewrites the store with the given records and only the names they use. The old files stay
+        # in place until the new ones are complete, renaming the new data file to .new commits the
+        # replacement and finish_replace moves both into place, here or when the store is next opened.
+        data_tmp = self.data_file + '.tmp'
+        names_tmp = self.names_file + '.tmp'
+        names, codes = [], {}
+        try:
+            for tmp in (data_tmp, names_tmp):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            count = self.write(records, 'wb', data_tmp, names_tmp, names, codes)
+            os.rename(names_tmp, self.names_file + '.new')
+            os.rename(data_tmp, self.data_file + '.new')
+        finally:
+            for tmp in (data_tmp, names_tmp):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        # Records of an interrupted sync use the old names, they are part of what was replaced
+        if os.path.exists(self.pending_file):
+            os.remove(self.pending_file)
+        self.finish_replace()
+        self.names = names
+        self.codes = codes
+        return count
+
+    def finish_replace(self):
+        # Moves a committed replacement into place, the names first. Without the new data file the
+        # replacement never got committed and new names left over from it are removed.
+        data_new = self.data_file + '.new'
+        names_new = self.names_file + '.new'
+        if not os.path.exists(data_new):
+            if os.path.exists(names_new):
+                os.remove(names_new)
+            return
+        for new, current in ((names_new, self.names_file), (data_new, self.data_file)):
+            if os.path.exists(new):
+                if os.path.exists(current):
+                    os.remove(current)
+                os.rename(new, current)
+
+    def scan(self, data_file=None):
+        # Yields every stored record in file order, including superseded ones
+        data_file = data_file or self.data_file
+        if not os.path.exists(data_file):
+            return
+        with open(data_file, 'rb') as data:
+            check_header(data.read(HEADER.size), data_file)
+            buf = ''
+            while True:
+                chunk = data.read(read_size)
+                if not chunk:
+                    break
+                buf += chunk
+                # A record cut off by an interrupted append is left over at the end and ignored
+                end = len(buf) - len(buf) % RECORD.size
+                for offset in range(0, end, RECORD.size):
+                    number, timestamp, duration, instance, version = RECORD.unpack_from(buf, offset)
+                    yield {
+                        'number': number,
+                        'timestamp': timestamp,
+                        'duration': duration,
+                        'instance': self.decode(instance),
+                        'version': self.decode(version),
+                        'kind': self.kind,
+                    }
+                buf = buf[end:]
+
+    def records(self):
+        # The current record of every build, newest build first
+        latest = {}
+        for record in self.scan():
+            latest[record['number']] = record
+        return sorted(latest.values(), key=lambda r: r['number'], reverse=True)
+
+    def compact(self):
+        self.commit_pending()
+        return self.replace(self.records())
+
+    def view(self):
+        # Maps the data file into memory and returns the records as a read-only structured array
+        # of RECORD_DTYPE, nothing is parsed or copied until a column is used
+        with open(self.data_file, 'rb') as data:
+            size = os.fstat(data.fileno()).st_size
+            check_header(data.read(HEADER.size), self.data_file)
+            count = (size - HEADER.size) // RECORD.size
+            if count == 0:
+                return np.zeros(0, RECORD_DTYPE)
+            mapped = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mapped, RECORD_DTYPE, count, HEADER.size)
+
+
+def latest_records(records):
+    # Mask of the current record of every build, the one appended last
+    numbers = records['number'][::-1]
+    unique, first = np.unique(numbers, return_index=True)
+    latest = np.zeros(len(records), bool)
+    latest[len(records) - 1 - first] = True
+    return latest
+
+
+class BuildView(object):
+    # Answers the update time queries straight from the mapped store with masked reductions.
+    # Superseded records of a build are masked out, a build fetched again may have been started
+    # again under the same number and its earlier record no longer counts.
+
+    def __init__(self, store):
+        self.records = store.view()
+        self.latest = latest_records(self.records)
+        self.codes = store.codes
+        self.names = store.names
+
+    def __len__(self):
+        return len(self.records)
+
+    def mask(self, version, instances=None):
+        with instrument.span('filter', version=version) as span:
+            code = self.codes.get(version)
+            if code is None:
+                return np.zeros(len(self.records), bool)
+            mask = (self.records['version'] == code) & self.latest
+            if instances is not None:
+                codes = [self.codes[instance] for instance in instances if instance in self.codes]
+                mask &= np.in1d(self.records['instance'], codes)
+            span.add(records=len(self.records))
+        return mask
+
+    def first_started(self, version, instances=None):
+        timestamp = self.records['timestamp'][self.mask(version, instances)]
+        return long(timestamp.min()) if len(timestamp) else None
+
+    def last_finished(self, version, instances=None):
+        selected = self.records[self.mask(version, instances)]
+        return long((selected['timestamp'] + selected['duration']).max()) if len(selected) else None
@@ -0,0 +1,137 @@
+import numpy as np
+
+# Start time of a slice without any build still running
+NO_BUILD = np.iinfo(np.int64).min
+
+
+class BuildTable(object):
+    # Columnar copy of the valid records of one job. Rows are sorted by (version, instance),
+    # so the builds of one instance for one version are a contiguous slice of every column
+    # and per-slice reductions are a single reduceat over the whole table.
+
+    def __init__(self, number, timestamp, duration, instance, version, instances, versions):
+        self.number = number
+        self.timestamp = timestamp
+        self.duration = duration
+        self.finish = timestamp + duration
+        self.instance = instance
+        self.version = version
+        self.instances = instances
+        self.versions = versions
+        self.instance_codes = dict((name, code) for code, name in enumerate(instances))
+        self.version_codes = dict((name, code) for code, name in enumerate(versions))
+
+        # One entry per (instance, version) slice
+        if len(number):
+            boundary = np.flatnonzero((np.diff(instance) != 0) | (np.diff(version) != 0)) + 1
+            self.key_start = np.concatenate(([0], boundary))
+        else:
+            self.key_start = np.zeros(0, np.int64)
+        self.key_stop = np.append(self.key_start[1:], len(number))
+        self.key_instance = instance[self.key_start]
+        self.key_version = version[self.key_start]
+        self.key_count = self.key_stop - self.key_start
+        if len(number):
+            self.key_first_started = np.minimum.reduceat(timestamp, self.key_start)
+            self.key_last_finished = np.maximum.reduceat(self.finish, self.key_start)
+            # Start of the newest build still running (duration 0) of every slice, or NO_BUILD
+            self.key_running_started = np.maximum.reduceat(np.where(duration == 0, timestamp, NO_BUILD),
+                                                           self.key_start)
+        else:
+            self.key_first_started = self.key_last_finished = np.zeros(0, np.int64)
+            self.key_running_started = np.zeros(0, np.int64)
+        self.keys = dict(((instances[i], versions[v]), k)
+                         for k, (i, v) in enumerate(zip(self.key_instance, self.key_version)))
+
+    def __len__(self):
+        return len(self.number)
+
+    @classmethod
+    def from_records(cls, records):
+        records = [r for r in records if r['instance'] is not None and r['version'] is not None]
+        instances = sorted(set(r['instance'] for r in records))
+        versions = sorted(set(r['version'] for r in records))
+        instance_codes = dict((name, code) for code, name in enumerate(instances))
+        version_codes = dict((name, code) for code, name in enumerate(versions))
+
+        count = len(records)
+        number = np.fromiter((r['number'] for r in records), np.int64, count)
+        timestamp = np.fromiter((r['timestamp'] for r in records), np.int64, count)
+        duration = np.fromiter((r['duration'] for r in records), np.int64, count)
+        instance = np.fromiter((instance_codes[r['instance']] for r in records), np.int32, count)
+        version = np.fromiter((version_codes[r['version']] for r in records), np.int32, count)
+
+        order = np.lexsort((timestamp, instance, version))
+        return cls(number[order], timestamp[order], duration[order], instance[order], version[order],
+                   instances, versions)
+
+    @classmethod
+    def from_store(cls, store):
+        # Builds the table from the mapped store columns. Instance and version codes are the
+        # store's name codes, a build fetched more than once only keeps its last record.
+        records = store.view()
+        records = records[(records['instance'] >= 0) & (records['version'] >= 0)]
+        position = np.arange(len(records))
+        order = np.lexsort((position, records['number'], records['instance'], records['version']))
+        records = records[order]
+        latest = np.append(records['number'][1:] != records['number'][:-1], True)[:len(records)]
+        records = records[latest]
+        return cls(records['number'].copy(), records['timestamp'].copy(), records['duration'].copy(),
+                   records['instance'].copy(), records['version'].copy(), store.names, store.names)
+
+    @classmethod
+    def from_index(cls, index):
+        return cls.from_records(index.by_number.itervalues())
+
+    def select(self, version, instances=None):
+        # Positions of the (instance, version) slices, instances=None means all instances
+        if instances is None:
+            code = self.version_codes.get(version)
+            return np.flatnonzero(self.key_version == code) if code is not None else np.zeros(0, np.int64)
+        keys = [self.keys.get((instance, version)) for instance in instances]
+        return np.array([k for k in keys if k is not None], np.int64)
+
+    def first_started(self, version, instances=None):
+        keys = self.select(version, instances)
+        return long(self.key_first_started[keys].min()) if len(keys) else None
+
+    def last_finished(self, version, instances=None):
+        keys = self.select(version, instances)
+        return long(self.key_last_finished[keys].max()) if len(keys) else None
+
+    def instance_spans(self, version, instances=None, now=None, since=None):
+        # (first started, last finished) per instance, an instance with a build still running
+        # finishes at now if given. With since only builds started at or after it count as still
+        # running, an older one without a duration is stale and ends where it started.
+        keys = self.select(version, instances)
+        last_finished = self.key_last_finished
+        if now is not None:
+            running = self.key_running_started > NO_BUILD
+            if since is not None:
+                running &= self.key_running_started >= since
+            last_finished = np.where(running, now, last_finished)
+        return dict((self.instances[self.key_instance[k]],
+                     (long(self.key_first_started[k]), long(last_finished[k]))) for k in keys)
+
+    def group_windows(self, groups):
+        # Returns the group names plus (first started, last finished, build count) arrays
+        # shaped [version, group] for every version and group at once
+        names = sorted(groups)
+        instance_group = np.full(len(self.instances), -1, np.int64)
+        for g, name in enumerate(names):
+            for instance in groups[name]:
+                code = self.instance_codes.get(instance)
+                if code is not None:
+                    instance_group[code] = g
+
+        shape = (len(self.versions), len(names))
+        first = np.full(shape, np.iinfo(np.int64).max, np.int64)
+        last = np.full(shape, np.iinfo(np.int64).min, np.int64)
+        count = np.zeros(shape, np.int64)
+        key_group = instance_group[self.key_instance]
+        grouped = key_group >= 0
+        cells = (self.key_version[grouped], key_group[grouped])
+        np.minimum.at(first, cells, self.key_first_started[grouped])
+        np.maximum.at(last, cells, self.key_last_finished[grouped])
+        np.add.at(count, cells, self.key_count[grouped])
+        return names, first, last, count
@@ -1,14 +1,26 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import json
+import time
+import socket
 import urllib
 import urllib2
+import httplib
+import urlparse
 import cookielib
+import StringIO
 import logging
 import argparse
+import threading
+import collections
+import copy
+from multiprocessing.pool import ThreadPool
 import traceback
 
+import instrument
+
 """
 
         Usage:
@@ -69,6 +81,31 @@ T_ERP_NUMBER = "erpnumber="
 T_DESCRIPTION = "description="
 T_CLASSIFICATION = "classification="
 
+# Batch lookups fan out over at most this many threads
+BATCH_MAX_WORKERS = 8
+
+# Names folded into one filter request take at most this many bytes of query string,
+# well below the URL length limits of servers and proxies
+BATCH_MAX_QUERY = 2048
+
+# Redirects followed on pooled connections, at most MAX_REDIRECTS in a row like urllib2
+REDIRECT_CODES = (301, 302, 303, 307)
+MAX_REDIRECTS = 10
+
+# Result of one key of a batch call: the looked up object or the exception raised for that key
+BatchResult = collections.namedtuple("BatchResult", ["value", "error"])
+
+# Result of one system of a bulk metadata update: the updated system object, the
+# _validateResponse code of every field, the number of PATCH attempts and the exception
+# that failed the update (None on success)
+UpdateResult = collections.namedtuple("UpdateResult", ["value", "codes", "attempts", "error"])
+
+# A PATCH rejected with 409 (stale versionUuid) or 423 (resource locked) is retried this
+# many times with a freshly read versionUuid, waiting CONFLICT_BACKOFF seconds times the attempt
+CONFLICT_CODES = (409, 423)
+CONFLICT_RETRIES = 3
+CONFLICT_BACKOFF = 0.5
+
 cic_argparser = argparse.ArgumentParser(add_help=False)
 cic_argparser.add_argument("--cic-user", help="CIC Userid ( Your D/I number )", required=True)
 cic_argparser.add_argument("--cic-password", help="CIC Password", required=False)
@@ -76,13 +113,60 @@ cic_argparser.add_argument("--cic-url", help="CIC URL (https://cic.mo.sap.corp):
 
 class CicDaO(object):
 
-        def __init__(self,cicUser,cicPassword,cicUrl="https://cic.mo.sap.corp"):
+        def __init__(self,cicUser,cicPassword,cicUrl="https://cic.mo.sap.corp",metadataCache=None,lazyLogin=False,readCacheSize=0,maxConnections=0,httpCache=None):
+
+                """
+                :param metadataCache:   optional MetadataCache, instance lists and system/tenant
+                                        lookups are served from it while they are fresh
+                :param lazyLogin:       log in with the first request instead of right away,
+                                        so a run answered from the cache never contacts CIC
+                :param readCacheSize:   keep up to this many systems/tenants looked up by name
+                                        or uid in memory (0 disables the cache)
+                :param maxConnections:  reuse up to this many persistent connections to CIC
+                                        (0 opens a new connection per request)
+                :param httpCache:       optional httpcache.HttpCache, GET requests are revalidated
+                                        with ETag/Last-Modified and a 304 is served from disk
+                """
 
                 logger.debug("Initializing CICDaO with url: {}".format(cicUrl))
-                self.httpHandler = HttpHandler(cicUser,cicPassword,cicUrl)
+                self.httpHandler = HttpHandler(cicUser,cicPassword,cicUrl,lazyLogin,maxConnections,httpCache)
                 self.helperObject = HelperObject()
                 self.cicUrl = cicUrl
                 self.cicUser = cicUser
+                self.metadataCache = metadataCache
+                self.readCache = LruCache(readCacheSize) if readCacheSize > 0 else None
+
+        def _cacheLookup(self, endpoint, params):
+            if self.metadataCache is None:
+                return None
+            return self.metadataCache.get(endpoint, params)
+
+        def _cacheStore(self, endpoint, params, value):
+            if self.metadataCache is not None:
+                self.metadataCache.put(endpoint, params, value)
+            return value
+
+        def _cacheInvalidate(self, endpoint, params=None):
+            if self.metadataCache is not None:
+                self.metadataCache.invalidate(endpoint, params)
+
+        def _cacheSave(self):
+            if self.metadataCache is not None:
+                self.metadataCache.save()
+
+        def _readCacheGet(self, key):
+            if self.readCache is None:
+                return None
+            return self.readCache.get(key)
+
+        def _readCachePut(self, key, value):
+            if self.readCache is not None:
+                self.readCache.put(key, value)
+            return value
+
+        def _readCacheInvalidate(self, uuid):
+            if self.readCache is not None:
+                self.readCache.invalidate(uuid)
 
         def hasPrivilege(self, privilege, groupid=None):
 
@@ -216,6 +300,10 @@ class CicDaO(object):
                 """
 
                 logger.debug("Call to getSystemByUid - uid: {}".format(uid))
+                cached = self._readCacheGet(("systemUid", uid))
+                if cached is not None:
+                    return cached
+
                 try:
                     response = self.httpHandler.sendHttpRequest(CIC_SYSTEM_ENDPOINT+"?uuid="+uid)
 
@@ -244,7 +332,7 @@ class CicDaO(object):
                         raise
                 else:
                     responseString = response.read()
-                    return json.loads(responseString)
+                    return self._readCachePut(("systemUid", uid), json.loads(responseString))
 
 
         def getSystemByName(self,systemName):
@@ -257,6 +345,13 @@ class CicDaO(object):
                 """
 
                 logger.debug("Call to getSystemByName - systemName: {}".format(systemName))
+                cached = self._readCacheGet(("systemName", systemName))
+                if cached is not None:
+                    return cached
+                cached = self._cacheLookup(CIC_SYSTEM_ENDPOINT, { "name": systemName })
+                if cached is not None:
+                    return self._readCachePut(("systemName", systemName), cached)
+
                 try:
 
                     response = self.httpHandler.sendHttpRequest(
@@ -294,7 +389,8 @@ class CicDaO(object):
                         raise
                 else:
                     responseString = response.read()
-                    return json.loads(responseString)
+                    systemObj = self._cacheStore(CIC_SYSTEM_ENDPOINT, { "name": systemName }, json.loads(responseString))
+                    return self._readCachePut(("systemName", systemName), systemObj)
 
         def getSystemUidBySystemName(self,systemName):
 
@@ -317,6 +413,9 @@ class CicDaO(object):
                 """
 
                 logger.debug("Call to getTenantByUid - uid: {}".format(uid))
+                cached = self._readCacheGet(("tenantUid", uid))
+                if cached is not None:
+                    return cached
 
                 try:
                     response = self.httpHandler.sendHttpRequest(CIC_TENANT_ENDPOINT+"?uuid="+uid)
@@ -343,7 +442,7 @@ class CicDaO(object):
                         raise
                 else:
                     responseString = response.read()
-                    return json.loads(responseString)
+                    return self._readCachePut(("tenantUid", uid), json.loads(responseString))
 
 
         def getTenantByName(self,tenantName,description):
@@ -364,6 +463,9 @@ class CicDaO(object):
                         })
 
                 logger.debug("Calling url {}".format(url))
+                cached = self._readCacheGet(("tenantName", tenantName, description))
+                if cached is not None:
+                    return cached
 
                 try:
                     response = self.httpHandler.sendHttpRequest(url)
@@ -392,7 +494,7 @@ class CicDaO(object):
                         raise
                 else:
                     responseString = response.read()
-                    return json.loads(responseString)
+                    return self._readCachePut(("tenantName", tenantName, description), json.loads(responseString))
 
 
         def getLandscapesByGroup(self, groupName):
@@ -412,6 +514,11 @@ class CicDaO(object):
 
             logger.debug("Call to getInstanceList:")
 
+            params = { "details[]": ["name", "updateGroup"], "enforce_complete_results": "true" }
+            cached = self._cacheLookup(CIC_SYSTEM_ENDPOINT, params)
+            if cached is not None:
+                return cached
+
             try:
                 response = self.httpHandler.sendHttpRequest\
                     (CIC_SYSTEM_ENDPOINT + "?details[]=name&details[]=updateGroup" + "&enforce_complete_results=true")
@@ -434,7 +541,7 @@ class CicDaO(object):
 
             else:
                 responseString = response.read()
-                return json.loads(responseString)
+                return self._cacheStore(CIC_SYSTEM_ENDPOINT, params, json.loads(responseString))
 
 
         def getAllTenants(self):
@@ -482,6 +589,10 @@ class CicDaO(object):
             else:
                 req = CIC_SYSTEM_ENDPOINT
 
+            cached = self._cacheLookup(CIC_SYSTEM_ENDPOINT, paramDict)
+            if cached is not None:
+                return cached
+
             try:
                 response = self.httpHandler.sendHttpRequest(req)
 
@@ -502,7 +613,7 @@ class CicDaO(object):
 
             else:
                 responseString = response.read()
-                return json.loads(responseString)
+                return self._cacheStore(CIC_SYSTEM_ENDPOINT, paramDict, json.loads(responseString))
 
         def getTenantsByFilter(self, filterSet, detailsNames):
 
@@ -523,6 +634,10 @@ class CicDaO(object):
             else:
                 req = CIC_TENANT_ENDPOINT
 
+            cached = self._cacheLookup(CIC_TENANT_ENDPOINT, paramDict)
+            if cached is not None:
+                return cached
+
 
             # We are currently not catching any exception here, because we don't know about the possible TMS error conditions 
             try:
@@ -546,7 +661,136 @@ class CicDaO(object):
 
             else:
                 responseString = response.read()
-                return json.loads(responseString)
+                return self._cacheStore(CIC_TENANT_ENDPOINT, paramDict, json.loads(responseString))
+
+        def _fanOut(self, function, keys, maxWorkers):
+
+            """
+            Calls function once per key on a bounded thread pool and returns
+            a dict of BatchResult by key. An exception only fails its own key.
+            Tuple keys are passed as separate arguments
+            """
+
+            keys = list(collections.OrderedDict.fromkeys(keys))
+            results = {}
+            if not keys:
+                return results
+
+            def call(key):
+                try:
+                    value = function(*key) if isinstance(key, tuple) else function(key)
+                except Exception as e:
+                    logger.debug("Batch call for {} failed: {}".format(key, e))
+                    return key, BatchResult(None, e)
+                return key, BatchResult(value, None)
+
+            pool = ThreadPool(min(maxWorkers, len(keys)))
+            try:
+                for key, result in pool.imap_unordered(call, keys):
+                    results[key] = result
+            finally:
+                pool.close()
+                pool.join()
+                self._cacheSave()
+            return results
+
+        def getSystemsByNames(self, systemNames, maxWorkers=BATCH_MAX_WORKERS):
+
+            """
+            Batch variant of getSystemByName. TMS has no multi-name lookup
+            for complete system objects, so the lookups run concurrently
+            :param systemNames:     list of unique system names
+            :rtype:                 dict of BatchResult by system name
+            """
+
+            return self._fanOut(self.getSystemByName, systemNames, maxWorkers)
+
+        def getSystemsByUids(self, uids, maxWorkers=BATCH_MAX_WORKERS):
+
+            """
+            Batch variant of getSystemByUid
+            :param uids:    list of system unique identifiers
+            :rtype:         dict of BatchResult by uid
+            """
+
+            return self._fanOut(self.getSystemByUid, uids, maxWorkers)
+
+        def getTenantsByUids(self, uids, maxWorkers=BATCH_MAX_WORKERS):
+
+            """
+            Batch variant of getTenantByUid. TMS can not filter tenants by
+            several uids, so the lookups run concurrently
+            :param uids:    list of tenant unique identifiers
+            :rtype:         dict of BatchResult by uid
+            """
+
+            return self._fanOut(self.getTenantByUid, uids, maxWorkers)
+
+        def getTenantsByNames(self, tenantKeys, maxWorkers=BATCH_MAX_WORKERS):
+
+            """
+            Batch variant of getTenantByName. TMS can not filter tenants by
+            several (system, description) pairs, so the lookups run concurrently
+            :param tenantKeys:  list of (systemName, description) tuples
+            :rtype:             dict of BatchResult by (systemName, description)
+            """
+
+            return self._fanOut(self.getTenantByName, tenantKeys, maxWorkers)
+
+        def getSystemDetailsByNames(self, systemNames, detailsNames):
+
+            """
+            Looks up selected detail fields of many systems with as few
+            getSystemsByFilter requests as possible, each one filtering by up
+            to BATCH_MAX_QUERY bytes of names. Systems are matched by name on
+            the client, a name TMS does not return gets a KeyError with
+            CIC_SYSTEM_NOT_FOUND_ERR.
+            :param systemNames:     list of unique system names
+            :param detailsNames:    list of detail fields, "name" is always added
+            :rtype:                 dict of BatchResult by system name, the value
+                                    is the system's "details" dict
+            """
+
+            detailsNames = list(detailsNames)
+            if "name" not in detailsNames:
+                detailsNames.append("name")
+
+            found = {}
+            for names in self._chunkByQuery("name", systemNames):
+                for system in self.getSystemsByFilter({ "name": names }, detailsNames):
+                    found[system["details"]["name"]] = system["details"]
+
+            results = {}
+            for systemName in systemNames:
+                if systemName in found:
+                    results[systemName] = BatchResult(found[systemName], None)
+                else:
+                    results[systemName] = BatchResult(None, KeyError(
+                        "System with name '{}' was not found in TMS".format(systemName),
+                        "CIC_SYSTEM_NOT_FOUND_ERR"))
+            return results
+
+        def _chunkByQuery(self, key, values):
+
+            """
+            Splits values into lists whose key=value query parameters take
+            at most BATCH_MAX_QUERY bytes, a longer value gets a list of its own
+            """
+
+            chunks = []
+            chunk = []
+            size = 0
+            for value in collections.OrderedDict.fromkeys(values):
+                length = len(urllib.urlencode({ key: value })) + 1
+                if chunk and size + length > BATCH_MAX_QUERY:
+                    chunks.append(chunk)
+                    chunk = []
+                    size = 0
+                chunk.append(value)
+                size += length
+            if chunk:
+                chunks.append(chunk)
+            return chunks
 
         def changeTenantMetadata(self,systemName,tenantDescription,parameter,value):
 
@@ -581,6 +825,7 @@ class CicDaO(object):
             except urllib2.HTTPError as e:
 
                 logger.debug(traceback.format_exc())
+                self._readCacheInvalidate(tenantObj["uuid"])
 
                 if e.code == 403:
 
@@ -603,6 +848,8 @@ class CicDaO(object):
             else:
 
                 responseString = response.read()
+                self._cacheInvalidate(CIC_TENANT_ENDPOINT)
+                self._readCacheInvalidate(tenantObj["uuid"])
                 returnDict = json.loads(responseString)
                 logger.debug("Return dict is: {}".format(returnDict))
 
@@ -639,6 +886,7 @@ class CicDaO(object):
                 response = self.httpHandler.sendHttpRequest(endpoint, payload, "PATCH", "metadata")
             except urllib2.HTTPError as e:
                 logger.debug(traceback.format_exc())
+                self._readCacheInvalidate(tenantObj["uuid"])
                 body = e.read()
                 logger.debug("Response code: {}, response body: {}".format(e.code, body))
                 raise RuntimeError(
@@ -647,6 +895,8 @@ class CicDaO(object):
                             "CIC_MULTI_FIELDS_TENANT_METADATA_UPDATE_ERR")
             else:
                 responseString = response.read()
+                self._cacheInvalidate(CIC_TENANT_ENDPOINT)
+                self._readCacheInvalidate(tenantObj["uuid"])
                 returnDict = json.loads(responseString)
                 logger.debug("Return dict is: {}".format(returnDict))
 
@@ -704,6 +954,9 @@ class CicDaO(object):
             except urllib2.HTTPError as e:
 
                 logger.debug(traceback.format_exc())
+                self._readCacheInvalidate(sysObj["uuid"])
+                # A cached system object with a stale versionUuid fails every PATCH until it expires
+                self._cacheInvalidate(CIC_SYSTEM_ENDPOINT, { "name": systemName })
 
                 if e.code == 403:
 
@@ -726,6 +979,8 @@ class CicDaO(object):
             else:
 
                 responseString = response.read()
+                self._cacheInvalidate(CIC_SYSTEM_ENDPOINT)
+                self._readCacheInvalidate(sysObj["uuid"])
                 returnDict = json.loads(responseString)
                 logger.debug("Return dict is: {}".format(returnDict))
 
@@ -746,6 +1001,136 @@ class CicDaO(object):
                         "CIC_SYSTEM_METADATA_UPDATE_MISMATCH")
 
 
+        def changeMultiFieldsSystemMetadata(self, systemName, dictParamValue, conflictRetries=CONFLICT_RETRIES):
+
+            """
+            Manipulate several System metadata fields in TMS v2 with one PATCH.
+            A PATCH rejected because the versionUuid is stale (409) or the system
+            is locked (423) is retried with a freshly read system object.
+            :param: systemName          Unique name of the system/instance
+                                        (epmprodxx)
+            :param: dictParamValue      dict of parameter name and new value
+            :param: conflictRetries     number of retries on 409/423
+            :rtype: UpdateResult        value is the updated System Object, codes
+                                        the _validateResponse code of each field.
+                                        A failed validation is returned, not raised
+            """
+
+            logger.debug("Call to changeMultiFieldsSystemMetadata - systemName: {} fields: {}".format(systemName, dictParamValue))
+
+            attempt = 0
+            while True:
+                attempt += 1
+                sysObj = self.getSystemByName(systemName)
+                payload = {
+                            "versionUuid": sysObj["versionUuid"],
+                            "uuid": sysObj["uuid"],
+                            "landscape": sysObj["landscape"]
+                        }
+                payload.update(dictParamValue)
+                logger.debug(payload)
+
+                try:
+                    response = self.httpHandler.sendHttpRequest(CIC_SYSTEM_ENDPOINT, payload, "PATCH", "metadata")
+                except urllib2.HTTPError as e:
+
+                    logger.debug(traceback.format_exc())
+                    self._readCacheInvalidate(sysObj["uuid"])
+                    body = e.read()
+                    logger.debug("Response code: {}, response body: {}".format(e.code, body))
+
+                    if e.code in CONFLICT_CODES:
+                        # The cached object carries the stale versionUuid
+                        self._cacheInvalidate(CIC_SYSTEM_ENDPOINT, { "name": systemName })
+                        if attempt <= conflictRetries:
+                            time.sleep(CONFLICT_BACKOFF * attempt)
+                            continue
+                        raise RuntimeError(
+                                "System {} still conflicting after {} attempts: "
+                                "{}, Response body: {}".format(systemName, attempt, e, body),
+                                "CIC_SYSTEM_METADATA_UPDATE_CONFLICT")
+
+                    elif e.code == 403:
+                        raise RuntimeError(
+                        "User {} has no permission to update 'systems' in {} {}".format(self.cicUser, self.cicUrl, body),
+                        "CIC_NO_ACCESS"
+                        )
+
+                    else:
+                        raise RuntimeError(
+                                "An http error occured during multi-fields system metatdata update: "
+                                "{}, Response body: {}".format(e, body),
+                                "CIC_MULTI_FIELDS_SYSTEM_METADATA_UPDATE_ERR")
+
+                else:
+
+                    responseString = response.read()
+                    self._cacheInvalidate(CIC_SYSTEM_ENDPOINT)
+                    self._readCacheInvalidate(sysObj["uuid"])
+                    returnDict = json.loads(responseString)
+                    logger.debug("Return dict is: {}".format(returnDict))
+
+                    codes = dict((parameter, self._validateResponse(returnDict, parameter, value))
+                                 for parameter, value in dictParamValue.iteritems())
+                    return UpdateResult(returnDict, codes, attempt, None)
+
+        def updateSystemsMetadata(self, changes, maxWorkers=BATCH_MAX_WORKERS, conflictRetries=CONFLICT_RETRIES):
+
+            """
+            Bulk metadata update, e.g. setting underMaintenance on a whole update
+            group. Every system is updated with one changeMultiFieldsSystemMetadata
+            call on a pool of maxWorkers threads, so throughput grows with the
+            worker count until CIC (or the maxConnections pool) is the limit.
+            Changes of the same system are merged into one PATCH, later fields win.
+            :param changes:         list of (systemName, dict of parameter and value)
+            :param maxWorkers:      number of systems updated concurrently
+            :param conflictRetries: number of retries per system on 409/423
+            :rtype:                 dict of UpdateResult by system name. A system
+                                    whose PATCH failed has codes None and the
+                                    exception in error, one with a field that
+                                    did not validate (code 2 or 3) has a
+                                    RuntimeError with the NOTWRITE/MISMATCH code
+            """
+
+            merged = collections.OrderedDict()
+            for systemName, fields in changes:
+                merged.setdefault(systemName, {}).update(fields)
+            results = {}
+            if not merged:
+                return results
+
+            def update(item):
+                systemName, fields = item
+                try:
+                    result = self.changeMultiFieldsSystemMetadata(systemName, fields, conflictRetries)
+                except Exception as e:
+                    logger.debug("Bulk update of {} failed: {}".format(systemName, e))
+                    return systemName, UpdateResult(None, None, None, e)
+
+                for parameter, rc in result.codes.iteritems():
+                    if rc == 2:
+                        return systemName, result._replace(error=RuntimeError(
+                            "System metadata update failed. "
+                            "Parameter '{}' not written. Maybe invalid parameter.".format(parameter),
+                            "CIC_SYSTEM_METADATA_UPDATE_NOTWRITE"))
+                    elif rc == 3:
+                        return systemName, result._replace(error=RuntimeError(
+                            "System metadata update failed. "
+                            "Parameter '{}' written but different return value: {} != {}.".format(
+                                parameter, fields[parameter], result.value[parameter]),
+                            "CIC_SYSTEM_METADATA_UPDATE_MISMATCH"))
+                return systemName, result
+
+            pool = ThreadPool(min(maxWorkers, len(merged)))
+            try:
+                for systemName, result in pool.imap_unordered(update, merged.items()):
+                    results[systemName] = result
+            finally:
+                pool.close()
+                pool.join()
+                self._cacheSave()
+            return results
+
         def _validateResponse(self, returnDict, parameter, value):
             logger.debug("Call to _validateResponse - returnDict: {} parameter: {} value: {}".format(returnDict, parameter, value))
 
@@ -792,6 +1177,7 @@ class CicDaO(object):
             else:
                 logger.debug("Sending POST request to {}, payload: {}".format(CIC_SYSTEM_ENDPOINT, payload))
                 response =  self.httpHandler.sendHttpRequest(CIC_SYSTEM_ENDPOINT,payload,"POST")
+                self._cacheInvalidate(CIC_SYSTEM_ENDPOINT)
                 if response is not None:
                     return self.helperObject._evaluateHttpConnStatus(response.getcode(),response)
                 else:
@@ -840,6 +1226,7 @@ class CicDaO(object):
                 elif response is None:
                     print "*** INFO *** Starting tenant creation"
                     response = self.httpHandler.sendHttpRequest(CIC_TENANT_ENDPOINT,payload,"POST")
+                    self._cacheInvalidate(CIC_TENANT_ENDPOINT)
                     status = response.getcode()
                     if status == 202:
                         print "*** INFO *** Tenant creation successfully triggered"
@@ -849,6 +1236,80 @@ class CicDaO(object):
             except AttributeError as e:
                 print "*** INFO *** Discarding request.Please wait until tenant creation finishes before sending another request"
 
+class AsyncCicDaO(object):
+
+        def __init__(self, cicUser, cicPassword, cicUrl="https://cic.mo.sap.corp", maxConcurrency=16, metadataCache=None, readCacheSize=0):
+
+                """
+                Non-blocking counterpart of CicDaO. Every method takes the same
+                arguments as the CicDaO method of the same name, starts the call
+                on a pool of maxConcurrency workers and returns right away with a
+                multiprocessing AsyncResult. result.get() returns the value or
+                raises the same exception (with the same CIC_* error code) the
+                blocking call would have raised.
+
+                All calls share one CicDaO: one cookie based login, made by the
+                first request, and a pool of maxConcurrency keep-alive
+                connections, so at most maxConcurrency requests are in flight.
+
+                futures = [cicObj.getSystemByName(name) for name in names]
+                systems = gatherResults(futures)
+                """
+
+                self.cicDaO = CicDaO(cicUser, cicPassword, cicUrl, metadataCache, lazyLogin=True,
+                                     readCacheSize=readCacheSize, maxConnections=maxConcurrency)
+                self.httpHandler = self.cicDaO.httpHandler
+                self.maxConcurrency = maxConcurrency
+                self.pool = ThreadPool(maxConcurrency)
+
+        def __getattr__(self, name):
+
+            """ Every public CicDaO method is available here under the same
+            name and with the same arguments, it submits the call and returns
+            the AsyncResult. Nothing is wrapped by hand, so a method added to
+            CicDaO is never missing here
+            """
+
+            cicDaO = self.__dict__.get("cicDaO")
+            method = getattr(cicDaO, name, None) if not name.startswith("_") else None
+            if not callable(method):
+                raise AttributeError("'AsyncCicDaO' object has no attribute '{}'".format(name))
+
+            def submit(*args, **kwargs):
+                return self.pool.apply_async(method, args, kwargs)
+            submit.__name__ = name
+            submit.__doc__ = method.__doc__
+            return submit
+
+        def close(self):
+
+            """ Waits for the submitted calls and stops the workers
+            """
+
+            self.pool.close()
+            self.pool.join()
+            if self.httpHandler.pool is not None:
+                self.httpHandler.pool.close()
+
+
+def gatherResults(asyncResults, timeout=None):
+
+    """
+    Waits for a list of AsyncCicDaO results and returns a list of
+    BatchResult in the same order, a failed call has its exception in
+    the error field instead of raising
+    """
+
+    results = []
+    for asyncResult in asyncResults:
+        try:
+            # get() without a timeout can not be interrupted with Ctrl-C on python 2
+            results.append(BatchResult(asyncResult.get(timeout if timeout is not None else 1e9), None))
+        except Exception as e:
+            results.append(BatchResult(None, e))
+    return results
+
+
 class HelperObject(object):
 
         def _evaluateHttpConnStatus(self,statusCode,response=None):
@@ -898,19 +1359,267 @@ class HelperObject(object):
                 return self.removePrefix(systemObject["rootUrl"],prefix)
 
 
+class MetadataCache(object):
+
+        def __init__(self, cacheFile, ttl=3600):
+
+                """
+                Persistent cache for CIC lookups that rarely change, like the
+                instance list or system and tenant metadata. Entries are keyed by
+                endpoint and request parameters, kept in cacheFile between runs
+                and expire ttl seconds after they were fetched. New entries are kept
+                in memory and written by save(), which CicDaO calls after a batch
+                call, the owner of the cache calls it after anything else.
+                Invalidations are written right away, another process must not
+                read an entry a write made stale. Values are copied in and out,
+                a caller changing a response never changes the cached one.
+                :param cacheFile:   path of the json file holding the entries
+                :param ttl:         time to live of an entry in seconds
+                """
+
+                self.cacheFile = cacheFile
+                self.ttl = ttl
+                self.lock = threading.Lock()
+                self.entries = {}
+                self.dirty = False
+                if os.path.exists(cacheFile):
+                    try:
+                        with open(cacheFile) as f:
+                            self.entries = json.load(f)
+                    except ValueError:
+                        logger.debug("Ignoring unreadable metadata cache {}".format(cacheFile))
+
+        def _makeKey(self, endpoint, params):
+            if not params:
+                return endpoint
+            return endpoint + "?" + urllib.urlencode(sorted(params.items()), True)
+
+        def _expired(self, entry, now):
+            return now - entry["fetched"] > self.ttl
+
+        def save(self):
+
+            """ Writes the entries to cacheFile if they changed, expired
+            entries are dropped first
+            """
+
+            with self.lock:
+                if not self.dirty:
+                    return
+                now = time.time()
+                for key in [k for k, e in self.entries.iteritems() if self._expired(e, now)]:
+                    del self.entries[key]
+                with open(self.cacheFile + ".tmp", "w") as f:
+                    json.dump(self.entries, f)
+                if os.path.exists(self.cacheFile):
+                    os.remove(self.cacheFile)
+                os.rename(self.cacheFile + ".tmp", self.cacheFile)
+                self.dirty = False
+
+        def get(self, endpoint, params=None):
+
+            """ Returns the cached response or None if there is no fresh entry
+            """
+
+            key = self._makeKey(endpoint, params)
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is None or self._expired(entry, time.time()):
+                    logger.debug("Metadata cache miss for {}".format(key))
+                    return None
+                value = copy.deepcopy(entry["value"])
+            logger.debug("Metadata cache hit for {}".format(key))
+            return value
+
+        def put(self, endpoint, params, value):
+            key = self._makeKey(endpoint, params)
+            value = copy.deepcopy(value)
+            with self.lock:
+                self.entries[key] = { "endpoint": endpoint, "fetched": time.time(), "value": value }
+                self.dirty = True
+
+        def invalidate(self, endpoint=None, params=None):
+
+            """ Drops one entry, all entries of an endpoint or, without
+            arguments, the whole cache
+            """
+
+            with self.lock:
+                if endpoint is None:
+                    self.entries = {}
+                elif params is not None:
+                    self.entries.pop(self._makeKey(endpoint, params), None)
+                else:
+                    for key in [k for k, e in self.entries.iteritems() if e["endpoint"] == endpoint]:
+                        del self.entries[key]
+                self.dirty = True
+            self.save()
+
+
+class LruCache(object):
+
+        def __init__(self, maxSize):
+
+                """
+                Bounded in-process cache for system and tenant objects, the least
+                recently used entry is dropped first. The same object is often
+                cached under several keys (name, uid), so entries are also tracked
+                by the object's uuid: a copy read under one key replaces the
+                copies under the other keys that carry a different versionUuid,
+                and a write invalidates all of them.
+                :param maxSize:     maximum number of entries
+                """
+
+                self.maxSize = maxSize
+                self.entries = collections.OrderedDict()
+                self.keysByUuid = {}
+                self.lock = threading.Lock()
+                self.hits = 0
+                self.misses = 0
+
+        def _uuidOf(self, value):
+            return value.get("uuid") if isinstance(value, dict) else None
+
+        def _remove(self, key):
+            value = self.entries.pop(key)
+            uuid = self._uuidOf(value)
+            if uuid is not None:
+                self.keysByUuid[uuid].discard(key)
+                if not self.keysByUuid[uuid]:
+                    del self.keysByUuid[uuid]
+
+        def get(self, key):
+            with self.lock:
+                if key not in self.entries:
+                    self.misses += 1
+                    return None
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.hits += 1
+                return value
+
+        def put(self, key, value):
+            uuid = self._uuidOf(value)
+            with self.lock:
+                if key in self.entries:
+                    self._remove(key)
+                if uuid is not None:
+                    for other in self.keysByUuid.get(uuid, ()):
+                        if self.entries[other].get("versionUuid") != value.get("versionUuid"):
+                            self.entries[other] = value
+                    self.keysByUuid.setdefault(uuid, set()).add(key)
+                self.entries[key] = value
+                while len(self.entries) > self.maxSize:
+                    self._remove(next(iter(self.entries)))
+
+        def invalidate(self, uuid=None):
+
+            """ Drops every entry of the object with the given uuid, or
+            everything without an argument
+            """
+
+            with self.lock:
+                if uuid is None:
+                    self.entries.clear()
+                    self.keysByUuid.clear()
+                else:
+                    for key in list(self.keysByUuid.get(uuid, ())):
+                        self._remove(key)
+
+
+class ConnectionPool(object):
+
+        def __init__(self, url, maxSize, timeout=60):
+
+                """
+                Keeps up to maxSize persistent (keep-alive) connections to the
+                host of url. acquire() blocks while all of them are in use.
+                :param url:         base url, only scheme, host and port are used
+                :param maxSize:     maximum number of open connections
+                :param timeout:     socket timeout of a connection in seconds
+                """
+
+                parsed = urlparse.urlparse(url)
+                self.connectionClass = httplib.HTTPSConnection if parsed.scheme == "https" else httplib.HTTPConnection
+                self.scheme = parsed.scheme
+                self.host = parsed.netloc
+                self.maxSize = maxSize
+                self.timeout = timeout
+                self.idle = []
+                self.lock = threading.Lock()
+                self.slots = threading.BoundedSemaphore(maxSize)
+                self.created = 0
+                self.reused = 0
+                self.discarded = 0
+                self.requests = 0
+
+        def acquire(self):
+
+            """ Returns (connection, reused), reused tells whether the
+            connection already served a request before
+            """
+
+            self.slots.acquire()
+            with self.lock:
+                self.requests += 1
+                if self.idle:
+                    self.reused += 1
+                    return self.idle.pop(), True
+                self.created += 1
+            return self.connectionClass(self.host, timeout=self.timeout), False
+
+        def release(self, connection, reusable=True):
+            with self.lock:
+                if reusable:
+                    self.idle.append(connection)
+                else:
+                    self.discarded += 1
+                    connection.close()
+            self.slots.release()
+
+        def close(self):
+            with self.lock:
+                for connection in self.idle:
+                    connection.close()
+                self.idle = []
+
+        def getMetrics(self):
+            with self.lock:
+                return {
+                    "maxSize": self.maxSize,
+                    "idle": len(self.idle),
+                    "open": self.created - self.discarded,
+                    "created": self.created,
+                    "reused": self.reused,
+                    "discarded": self.discarded,
+                    "requests": self.requests
+                }
+
+
 class HttpHandler(object):
 
-    def __init__(self,cicUser, cicPassword,cicUrl):
+    def __init__(self,cicUser, cicPassword,cicUrl,lazyLogin=False,maxConnections=0,httpCache=None):
 
             """
             Handler needs Authentication parameters and the url to call
+            With lazyLogin the login happens with the first request
+            With maxConnections > 0 requests go over a pool of at most that many
+            persistent connections instead of a new connection per request,
+            they all share the session cookie of login()
+            With an httpCache GET responses are revalidated instead of downloaded again
             """
 
             self.cicUser = cicUser
             self.cicPassword = cicPassword
             self.cicUrl = cicUrl
+            self.opener = None
+            self.cookieJar = None
+            self.loginLock = threading.Lock()
+            self.pool = ConnectionPool(cicUrl, maxConnections) if maxConnections > 0 else None
+            self.httpCache = httpCache
 
-            self.login()
+            if not lazyLogin:
+                self.login()
 
     def login(self):
         """
@@ -940,8 +1649,81 @@ class HttpHandler(object):
 
         else:
             self.opener = opener
+            self.cookieJar = cj
             logger.debug("Cookie aquired for user {}".format (cookie.read()))
 
+    def getPoolMetrics(self):
+
+        """ Returns the connection pool counters or None without a pool
+        """
+
+        if self.pool is None:
+            return None
+        return self.pool.getMetrics()
+
+    def _openPooled(self, request, redirects=0):
+
+        """ Sends a urllib2 request over a pooled connection and returns a
+        urllib2 style response. Follows redirects and raises urllib2.HTTPError
+        for error codes like the opener does
+        """
+
+        self.cookieJar.add_cookie_header(request)
+        headers = dict(request.header_items())
+        body = request.get_data()
+        if body is not None:
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+
+        while True:
+            connection, reused = self.pool.acquire()
+            try:
+                connection.request(request.get_method(), request.get_selector(), body, headers)
+                httpResponse = connection.getresponse()
+                responseBody = httpResponse.read()
+            except (httplib.HTTPException, socket.error):
+                self.pool.release(connection, False)
+                # The server may have closed an idle keep-alive connection, retry once on a new one
+                if reused:
+                    logger.debug("Pooled connection was closed, reconnecting")
+                    continue
+                raise
+            self.pool.release(connection, not httpResponse.will_close)
+            break
+
+        response = urllib.addinfourl(StringIO.StringIO(responseBody), httpResponse.msg,
+                                     request.get_full_url(), httpResponse.status)
+        self.cookieJar.extract_cookies(response, request)
+        if httpResponse.status in REDIRECT_CODES and httpResponse.getheader("Location"):
+            return self._redirectPooled(request, httpResponse, responseBody, redirects)
+        if not 200 <= httpResponse.status < 300:
+            raise urllib2.HTTPError(request.get_full_url(), httpResponse.status, httpResponse.reason,
+                                    httpResponse.msg, StringIO.StringIO(responseBody))
+        return response
+
+    def _redirectPooled(self, request, httpResponse, responseBody, redirects):
+
+        """ Follows a redirect the way urllib2.HTTPRedirectHandler does, the
+        new request is a GET without body and a 307 is only followed for a GET
+        or HEAD. A location on the pooled host is requested over the pool,
+        any other one over the opener
+        """
+
+        method = request.get_method()
+        if redirects >= MAX_REDIRECTS or (httpResponse.status == 307 and method not in ("GET", "HEAD")):
+            raise urllib2.HTTPError(request.get_full_url(), httpResponse.status, httpResponse.reason,
+                                    httpResponse.msg, StringIO.StringIO(responseBody))
+
+        newUrl = urlparse.urljoin(request.get_full_url(), httpResponse.getheader("Location"))
+        headers = dict((k, v) for k, v in request.headers.items()
+                       if k.lower() not in ("content-length", "content-type"))
+        newRequest = urllib2.Request(newUrl, headers=headers)
+        logger.debug("Following redirect {} to {}".format(httpResponse.status, newUrl))
+
+        parsed = urlparse.urlparse(newUrl)
+        if parsed.scheme == self.pool.scheme and parsed.netloc == self.pool.host:
+            return self._openPooled(newRequest, redirects + 1)
+        return self.opener.open(newRequest)
+
 
     def createHttpRequest(self, endpoint, payload=None, method=None, xDepth=None):
 
@@ -1004,6 +1786,11 @@ class HttpHandler(object):
 
             response = None
             request = self.createHttpRequest(endpoint, payload, method, xDepth)
+            if self.opener is None:
+                # Concurrent first requests of a lazy handler log in only once
+                with self.loginLock:
+                    if self.opener is None:
+                        self.login()
             opener = self.opener
 
             if ((payload is None) or (method == "GET")):
@@ -1016,7 +1803,14 @@ class HttpHandler(object):
                     logger.debug("Sending HTTP POST to "+request.get_full_url())
 
             try:
-                response = opener.open(request)
+                with instrument.span("cic", method=request.get_method(), endpoint=endpoint.split("?")[0]) as span:
+                    fetch = self._openPooled if self.pool is not None else opener.open
+                    if self.httpCache is not None:
+                        response = self.httpCache.open(request, fetch)
+                    else:
+                        response = fetch(request)
+                    # The body is read by the caller, its size is taken from the headers
+                    span.add(records=1, bytes=int(response.info().getheader("Content-Length") or 0))
 
             except urllib2.HTTPError as e:
                 """Preserve error response body and put it into exception message"""
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+import builds
+
+# A build is stuck when it runs longer than this percentile of the finished builds of its version,
+# with fewer than min_samples finished builds of the version the whole job history is used
+stuck_percentile = 95
+min_samples = 20
+
+
+def finished_durations(index, version):
+    durations = [record['duration'] for instance in index.instances(version)
+                 for record in index.by_key[(instance, version)] if record['duration'] > 0]
+    if len(durations) < min_samples:
+        durations = [record['duration'] for record in index.by_number.itervalues() if record['duration'] > 0]
+    return durations
+
+
+def duration_threshold(index, version):
+    durations = finished_durations(index, version)
+    return long(np.percentile(durations, stuck_percentile)) if durations else None
+
+
+def running_builds(index, version, instances, threshold, now):
+    # Builds of the version still running (duration 0) and whether they run past the threshold
+    running = []
+    for instance in index.instances(version).intersection(instances):
+        for record in index.by_key[(instance, version)]:
+            if record['duration'] == 0:
+                elapsed = now - record['timestamp']
+                running.append({
+                    'kind': record['kind'],
+                    'instance': instance,
+                    'number': record['number'],
+                    'timestamp': record['timestamp'],
+                    'elapsed': elapsed,
+                    'stuck': threshold is not None and elapsed > threshold,
+                })
+    return sorted(running, key=lambda build: (build['kind'], build['instance'], build['number']))
+
+
+def slow_builds(index, version, instances, threshold):
+    # Finished builds of the version that took longer than the threshold
+    if threshold is None:
+        return []
+    return sorted(({'kind': record['kind'], 'instance': record['instance'], 'number': record['number'],
+                    'duration': record['duration']}
+                   for record in index.get_group(instances, version) if record['duration'] > threshold),
+                  key=lambda build: (build['kind'], build['instance'], build['number']))
+
+
+def find_unfinished(fpa_index, fpa_ver, epm_index, epm_ver, instances, now=None):
+    # Unfinished update of a wave in a group of instances, the indexes are BuildIndex objects:
+    # missing_fpa are instances with an EPM build but no FPA build, running the builds without a
+    # duration yet (stuck ones past the threshold) and slow the finished builds past it.
+    if now is None:
+        now = long(time.time() * 1000)
+    instances = set(instances)
+    thresholds = {
+        builds.EPM: duration_threshold(epm_index, epm_ver),
+        builds.FPA: duration_threshold(fpa_index, fpa_ver),
+    }
+    epm_instances = epm_index.instances(epm_ver).intersection(instances)
+    fpa_instances = fpa_index.instances(fpa_ver).intersection(instances)
+    return {
+        'missing_fpa': sorted(epm_instances - fpa_instances),
+        'running': (running_builds(epm_index, epm_ver, instances, thresholds[builds.EPM], now) +
+                    running_builds(fpa_index, fpa_ver, instances, thresholds[builds.FPA], now)),
+        'slow': (slow_builds(epm_index, epm_ver, instances, thresholds[builds.EPM]) +
+                 slow_builds(fpa_index, fpa_ver, instances, thresholds[builds.FPA])),
+        'thresholds': thresholds,
+    }
+
+
+def findings(result):
+    # The findings of a find_unfinished result as a set of hashable events, for watch mode to compare
+    events = set(('missing_fpa', instance) for instance in result['missing_fpa'])
+    for build in result['running']:
+        events.add(('stuck' if build['stuck'] else 'running', build['kind'], build['instance'], build['number']))
+    for build in result['slow']:
+        events.add(('slow', build['kind'], build['instance'], build['number']))
+    return events
+
+
+def describe(event):
+    if event[0] == 'missing_fpa':
+        return '{} has no FPA build'.format(event[1])
+    return '{} build #{} of {} is {}'.format(event[1].upper(), event[3], event[2], event[0])
+
+
+def changes(old_events, new_events):
+    # Lines describing what appeared and what went away between two polls
+    lines = ['+ ' + describe(event) for event in sorted(new_events - old_events)]
+    lines += ['- ' + describe(event) for event in sorted(old_events - new_events)]
+    return lines
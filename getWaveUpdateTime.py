@@ -1,22 +1,69 @@
+import os
 import time
 import json
-import sys
+import atexit
+import argparse
 
 import math
 
 import cic
+import analysis
+import pairing
+import detector
+import timeline
+import instrument
+import profiler
+import httpcache
+import functools
+import builds
+import buildstore
+import buildtable
+import jenkins
 import datetime
-from pprint import pprint
-import urllib2, base64
 
 username = ''
 password = ''
 
 file_path = 'C:\Users\I852047\OneDrive - SAP SE\FPA35\Wave Update\Jenkins analysis\\'
-epm_log_file = 'epm log.json'
-fpa_log_file = 'fpa log.json'
+epm_store_file = 'epm builds'
+fpa_store_file = 'fpa builds'
+# JSON logs kept by earlier versions, imported once into a build store that does not exist yet
+epm_log_files = ['epm log.json', 'epm log - origin.json']
+fpa_log_files = ['fpa log.json', 'fpa log - origin.json']
+epm_job = 'HCP_Component_Update'
+fpa_job = 'Cloud_system_admin'
+
+# Only the parameters the analysis reads are kept from the builds of each job
+epm_query = jenkins.BuildQuery(parameters=['INSTANCE', 'EPM_VERSION'])
+fpa_query = jenkins.BuildQuery(parameters=['INSTANCE', 'FPA_DU_DIR'])
+
+# Only fetch builds newer than the stored history (plus the ones still running)
+incremental_sync = bool(1)
+
+# CIC instance and group metadata is reused for cic_cache_ttl seconds
+cic_cache_file = 'cic cache.json'
+cic_cache_ttl = 24 * 3600
+
+# FPA and EPM versions of each wave, counted from the stores and updated with every run
+pairing_file = 'version pairs.json'
+
+# Jenkins and CIC responses are kept here and revalidated with ETag/Last-Modified
+http_cache_dir = 'http cache'
+http_cache = None
+
+# Also report the update windows and trends of every wave in the build history
+report_history = bool(0)
+
+# Keep polling Jenkins for the newest wave and print what changes in its unfinished update
+watch_mode = bool(0)
+watch_interval = 300
+
+# Record a span for every pipeline stage and write them to trace_file (Chrome trace format)
+# and metrics_file (Prometheus text format)
+instrumentation = bool(0)
+trace_file = 'trace.json'
+metrics_file = 'metrics.prom'
 
-print_time = bool(0)
 group_info = {}
 
 
@@ -40,103 +87,68 @@ def get_authentication():
     f.close()
 
 
-def get_all_epm_builds():
-    start = time.time()
-    url = 'https://vandevopsjenkins01.pgdev.sap.corp/job/Cloud/job/HCP_Component_Update/api/json?depth=2&' \
-          'pretty=true&tree=allBuilds[number,timestamp,duration,actions[parameters[name,value]]]'
-
-    request = urllib2.Request(url)
-    base64string = base64.b64encode('%s:%s' % (username, password))
-    request.add_header("Authorization", "Basic %s" % base64string)
-    result = urllib2.urlopen(request)
-    builds = json.loads(result.read().decode())
-
-    write_json_to_file(builds, epm_log_file)
-    index = epm_log_file.find('.json')
-    origin_log_file = epm_log_file[:index] + ' - origin' + epm_log_file[index:]
-    write_json_to_file(builds, origin_log_file)
-
-    if print_time:
-        print("Got all builds in: {} s".format(int(time.time() - start)))
-    return builds
-
-
-def get_all_fpa_builds():
-    start = time.time()
-    url = 'https://vandevopsjenkins01.pgdev.sap.corp/job/Cloud/job/Cloud_system_admin/api/json?depth=2&' \
-          'pretty=true&tree=allBuilds[number,timestamp,duration,actions[parameters[name,value]]]'
-
-    request = urllib2.Request(url)
-    base64string = base64.b64encode('%s:%s' % (username, password))
-    request.add_header("Authorization", "Basic %s" % base64string)
-    result = urllib2.urlopen(request)
-    builds = json.loads(result.read().decode())
-
-    write_json_to_file(builds, fpa_log_file)
-    index = fpa_log_file.find('.json')
-    origin_log_file = fpa_log_file[:index] + ' - origin' + fpa_log_file[index:]
-    write_json_to_file(builds, origin_log_file)
-
-    if print_time:
-        print("Got all builds in: {} s".format(int(time.time() - start)))
-    return builds
-
-
-def pre_process_data(json_data, file_name):
-    start = time.time()
-    for build in json_data['allBuilds']:
-        actions = build['actions']
-        for i in range(len(actions) - 1, -1, -1):
-            if 'parameters' in build['actions'][i]:
-                parameters = build['actions'][i]['parameters']
-                for j in range(len(parameters) - 1, -1, -1):
-                    param = parameters[j]
-                    if param['name'] == 'SAP_PASSWORD' or param['name'] == 'HANA_PASSWORD':
-                        del parameters[j]
-                    if param['name'] == 'INSTANCE' or param['name'] == 'FPA_DU_DIR' or param['name'] == 'EPM_VERSION':
-                        build[param['name'].lower()] = param['value']
-                        if param['name'] == 'EPM_VERSION':
-                            build['version'] = param['value']
-                        elif param['name'] == 'FPA_DU_DIR':
-                            index = param['value'].rfind('/')
-                            build['version'] = param['value'][index + 1:]
-            else:
-                del build['actions'][i]
-
-    write_json_to_file(json_data, file_name)
-    if print_time:
-        print("Pre-process the data in: {} s".format(int(time.time() - start)))
-    return json_data
-
-
-def filter_builds_by_system_version(build_list, ins, ver):
-    builds = []
-    for build in build_list['allBuilds']:
-        if build['instance'] == ins and build['version'] == ver:
-            builds.append(build)
-    # pprint(builds)
-
-    write_json_to_file(builds, ins + ' - ' + ver + '.json')
-    return builds
-
-
-def filter_builds_by_group_version(build_list, group, ver):
-    start = time.time()
-    instances = group_info[group]
-    builds = []
-    invalid_builds = []
-    for build in build_list['allBuilds']:
-        if 'version' not in build or 'instance' not in build:
-            invalid_builds.append(build)
-        elif build['version'] == ver and build['instance'] in instances:
-            builds.append(build)
-    # pprint(builds)
-
-    write_json_to_file(invalid_builds, group + ' - ' + ver + ' - invalid.json')
-    write_json_to_file(builds, group + ' - ' + ver + '.json')
-    if print_time:
-        print("Filter by group in: {} s".format(int(time.time() - start)))
-    return builds
+def open_store(store_file, kind):
+    return buildstore.BuildStore(file_path + store_file, kind)
+
+
+def get_all_builds(job, store, index=None, query=jenkins.default_query):
+    # With an index the fetched builds are kept aside and only applied to it once the store
+    # committed them, a failed fetch leaves both the store and the index as they were
+    normalize = functools.partial(builds.normalize_build, kind=store.kind)
+    fetched = []
+
+    def keep(records):
+        for record in records:
+            fetched.append(record)
+            yield record
+
+    with instrument.span('sync', job=job) as span:
+        if incremental_sync and store.exists():
+            # Everything from sync_from on is fetched again and appended to the store
+            sync_from = jenkins.find_sync_point(store.records())
+            records = jenkins.fetch_builds(job, username, password, sync_from, normalize, query)
+            count, dropped = store.sync(keep(records) if index is not None else records, sync_from)
+        else:
+            records = jenkins.fetch_builds(job, username, password, process=normalize, query=query)
+            count = store.replace(keep(records) if index is not None else records)
+            dropped = set(index.by_number) - set(record['number'] for record in fetched) if index is not None else ()
+        span.add(records=count)
+
+    if index is not None:
+        for number in dropped:
+            if number in index.by_number:
+                index.remove(index.by_number[number])
+        index.update(fetched)
+    return count
+
+
+def import_json_log(store, log_files):
+    # Fills a new store from the first JSON log found, the sync after it then only fetches the
+    # builds newer than the log. The log is decoded one chunk at a time, never loaded as a whole.
+    if store.exists():
+        return 0
+    for log_file in log_files:
+        if os.path.exists(file_path + log_file):
+            with instrument.span('preprocess', kind=store.kind, log=log_file) as span:
+                with open(file_path + log_file, 'rb') as log:
+                    count = store.replace(builds.normalize_build(build, store.kind)
+                                          for build in jenkins.iter_builds(log))
+                span.add(records=count)
+            print("Imported {} builds from {}".format(count, log_file))
+            return count
+    return 0
+
+
+def get_all_epm_builds(index=None):
+    store = open_store(epm_store_file, builds.EPM)
+    import_json_log(store, epm_log_files)
+    return get_all_builds(epm_job, store, index, epm_query)
+
+
+def get_all_fpa_builds(index=None):
+    store = open_store(fpa_store_file, builds.FPA)
+    import_json_log(store, fpa_log_files)
+    return get_all_builds(fpa_job, store, index, fpa_query)
 
 
 # This method is currently not used, keep it just for reference
@@ -144,31 +156,35 @@ def get_fpa_dir(ver):
     return '/net/build-drops-wdf/dropzone/orca/EPM_FPA/rel/' + ver
 
 
-def build_group_info():
-    start = time.time()
+def group_instances(instance_list, groups):
     group_information = {}
+    for i in instance_list:
+        if i["details"]["updateGroup"] in groups:
+            group_information.setdefault(i["details"]["updateGroup"], []).append(i["details"]["name"])
+    return group_information
+
+
+def build_group_info():
     groups = ['Group1-EU', 'Group1-AP', 'Group1-US', 'Group2-EU', 'Group2-AP', 'Group2-US',
               'Group3-EU', 'Group3-AP', 'Group3-US']
 
     cic_user = username
     cic_password = password
     cic_url = "https://cic.mo.sap.corp"
-    cic_obj = cic.CicDaO(cic_user, cic_password, cic_url)
-    result = cic_obj.getInstanceList()
-
-    for i in result:
-        if i["details"]["updateGroup"] in groups:
-            group_information.setdefault(i["details"]["updateGroup"], []).append(i["details"]["name"])
+    cic_cache = cic.MetadataCache(file_path + cic_cache_file, cic_cache_ttl)
+    cic_obj = cic.CicDaO(cic_user, cic_password, cic_url, cic_cache, lazyLogin=True, httpCache=http_cache)
+    with instrument.span('group_info') as span:
+        result = cic_obj.getInstanceList()
+        group_information = group_instances(result, groups)
+        span.add(records=len(result))
+    cic_cache.save()
 
     write_json_to_file(group_information, 'group info.json')
-    if print_time:
-        print("Build group info in: {} s".format(int(time.time() - start)))
     return group_information
 
 
 # This method is currently not used, keep it just for reference
 def get_group_list(update_group):
-    start = time.time()
     cic_user = username
     cic_password = password
     cic_url = "https://cic.mo.sap.corp"
@@ -179,89 +195,195 @@ def get_group_list(update_group):
     instances = []
     for i in result:
         instances.append(i["details"]["name"])
-    if print_time:
-        print("Get group list in: {} s".format(int(time.time() - start)))
     return instances
 
 
-def find_first_started(builds):
-    start = time.time()
-    first_started = sys.maxint
-    first_build = {}
-    for build in builds:
-        started = build['timestamp'] / 1000
-        first_started = min(started, first_started)
-        if first_started == started:
-            first_build = build
-    first_started = datetime.datetime.fromtimestamp(first_started)
-    print first_started
-    # pprint(first_build)
-    if print_time:
-        print("Find first build in: {} s".format(int(time.time() - start)))
-    return first_started
-
-
-def find_last_finished(builds):
-    start = time.time()
-    last_finished = 0
-    for build in builds:
-        finished = (long(build['timestamp']) + build['duration']) / 1000
-        last_finished = max(finished, last_finished)
-    last_finished = datetime.datetime.fromtimestamp(last_finished)
-    print last_finished
-    if print_time:
-        print("Find last build in: {} s".format(int(time.time() - start)))
-    return last_finished
-
-
-def get_group_update_time(fpa_builds, fpa_ver, epm_builds, epm_ver, group):
-    fpa_builds = filter_builds_by_group_version(fpa_builds, group, fpa_ver)
-    epm_builds = filter_builds_by_group_version(epm_builds, group, epm_ver)
-    if fpa_builds == [] or epm_builds == []:
+def start_profiler(output, interval_ms):
+    # Samples every thread until the script exits (also from watch mode with Ctrl-C) and then writes
+    # the collapsed stacks for flamegraph tools plus the functions of this script, cic and the
+    # analysis workers that took longest
+    sampler = profiler.SamplingProfiler(interval_ms / 1000.0)
+
+    def finish():
+        sampler.stop()
+        sampler.write_collapsed(output)
+        print("Wrote {} samples to {}".format(sampler.samples, output))
+        for label, (total, own) in sampler.top(15, ['getWaveUpdateTime.', 'cic.', 'analysis.', 'buildstore.']):
+            print("{:>6} {:>6}  {}".format(total, own, label))
+
+    sampler.start()
+    atexit.register(finish)
+    return sampler
+
+
+def load_index(store_file, kind):
+    with instrument.span('preprocess', kind=kind, to='index') as span:
+        index = builds.BuildIndex(open_store(store_file, kind).records())
+        span.add(records=len(index))
+    return index
+
+
+def load_table(store_file, kind):
+    with instrument.span('preprocess', kind=kind, to='table') as span:
+        table = buildtable.BuildTable.from_store(open_store(store_file, kind))
+        span.add(records=len(table))
+    return table
+
+
+def detect_unfinished_update(fpa_index, fpa_ver, epm_index, epm_ver, group):
+    instances = group_info.get(group, [])
+    if not instances:
+        print(group + ": no instances")
+        return None
+    result = detector.find_unfinished(fpa_index, fpa_ver, epm_index, epm_ver, instances)
+    for event in sorted(detector.findings(result)):
+        print(group + ": " + detector.describe(event))
+    return result
+
+
+def watch(fpa_index, epm_index, version_pairing, groups):
+    # Every poll only fetches the builds since the last sync and reports what changed in the
+    # newest wave. The versions are paired again each time, so a wave starting meanwhile is
+    # followed, version_pairing needs at least one wave to start with.
+    events = dict((group, set()) for group in groups)
+    wave = version_pairing.pairs()[-1]
+    while True:
+        get_all_epm_builds(epm_index)
+        get_all_fpa_builds(fpa_index)
+        version_pairing.update(open_store(fpa_store_file, builds.FPA))
+        version_pairing.update(open_store(epm_store_file, builds.EPM))
+        version_pairing.save()
+        now = datetime.datetime.now().strftime('%H:%M:%S')
+        waves = version_pairing.pairs()
+        if waves and waves[-1] != wave:
+            wave = waves[-1]
+            events = dict((group, set()) for group in groups)
+            print("{} watching wave {} (EPM {})".format(now, wave[0], wave[1]))
+        fpa_ver, epm_ver = wave
+        for group in groups:
+            instances = group_info.get(group, [])
+            if not instances:
+                continue
+            result = detector.find_unfinished(fpa_index, fpa_ver, epm_index, epm_ver, instances)
+            new_events = detector.findings(result)
+            for line in detector.changes(events[group], new_events):
+                print("{} {} {}".format(now, group, line))
+            events[group] = new_events
+        time.sleep(watch_interval)
+
+
+def get_group_timeline(fpa_table, fpa_ver, epm_table, epm_ver, group):
+    instances = group_info.get(group, [])
+    if not instances:
+        print(group + ": no instances")
+        return None
+    result = timeline.group_timeline(fpa_table, fpa_ver, epm_table, epm_ver, instances, long(time.time() * 1000))
+    if result is None:
         print "Cannot find any build"
-    first_epm = find_first_started(epm_builds)
-    last_fpa = find_last_finished(fpa_builds)
-    print("Total " + group + " update time for wave " + fpa_ver + ": {} min"
-          .format(math.ceil((last_fpa - first_epm).total_seconds() / 60)))
-
-
-def get_system_update_time(fpa_builds, fpa_ver, epm_builds, epm_ver, ins):
-    fpa_builds = filter_builds_by_system_version(fpa_builds, ins, fpa_ver)
-    epm_builds = filter_builds_by_system_version(epm_builds, ins, epm_ver)
-    if fpa_builds == [] or epm_builds == []:
-        print "Cannot find any build"
-    first_epm = find_first_started(epm_builds)
-    last_fpa = find_last_finished(fpa_builds)
-    print(ins + " update time for wave " + fpa_ver + ": {} min"
-          .format(math.ceil((last_fpa - first_epm).total_seconds() / 60)))
+        return
+    minutes = lambda ms: int(math.ceil(ms / 60000.0)) if ms is not None else None
+    print(group + " wave " + fpa_ver + ": {} instances updating at once at most, {} builds, {} idle gaps"
+          .format(result['peak_updates'], result['peak_builds'], len(result['idle_gaps'])))
+    phases = result['phases']
+    print(group + " wave " + fpa_ver + ": EPM only {} min, FPA only {} min, both {} min, idle {} min"
+          .format(minutes(phases['epm_only']), minutes(phases['fpa_only']), minutes(phases['both']),
+                  minutes(phases['idle'])))
+    if result['open']:
+        print(group + " wave " + fpa_ver + ": {} builds running past the stuck threshold left open"
+              .format(len(result['open'])))
+    critical = result['critical_path']
+    print(group + " wave " + fpa_ver + ": finished last {} (EPM {} min, wait {} min, FPA {} min)"
+          .format(critical['instance'], minutes(critical['epm']), minutes(critical['wait']),
+                  minutes(critical['fpa'])))
+    return result
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Wave update time analysis from Jenkins and CIC")
+    parser.add_argument("--profile", nargs='?', const='profile.folded', metavar='FILE',
+                        help="sample the stack and write collapsed stacks to FILE (default: %(const)s)")
+    parser.add_argument("--profile-interval", type=float, default=profiler.default_interval * 1000,
+                        metavar='MS', help="sampling interval in milliseconds (default: %(default)s)")
+    args = parser.parse_args()
+    sampler = None
+    if args.profile:
+        sampler = start_profiler(args.profile, args.profile_interval)
+
     execution_start = time.time()
+    instrument.enabled = instrumentation
 
-    # Get Jenkins logs and preprocess the data
+    # Get Jenkins logs, the builds are preprocessed while they are downloaded
     get_authentication()
+    http_cache = httpcache.HttpCache(file_path + http_cache_dir)
+    jenkins.http_cache = http_cache
     get_all_epm_builds()
     get_all_fpa_builds()
-    pre_process_data(read_json_data(fpa_log_file), fpa_log_file)
-    pre_process_data(read_json_data(epm_log_file), epm_log_file)
     group_info = build_group_info()
 
     # Analyze the logs
-    group_info = read_json_data('group info.json')
-    all_fpa_builds = read_json_data(fpa_log_file)
-    all_epm_builds = read_json_data(epm_log_file)
-
+    # Every group and wave is analyzed in its own worker process on the mapped stores
     groups = ['Group1-AP', 'Group1-EU', 'Group1-US', 'Group2-AP', 'Group2-EU', 'Group2-US']
     # groups = ['Group3-AP', 'Group3-EU', 'Group3-US']
-    fpa_version = '2017.21'
-    epm_version = '1.00.201721.01'
-
-    for group_name in groups:
-        get_group_update_time(all_fpa_builds, fpa_version, all_epm_builds, epm_version, group_name)
-
+    targets = dict((group_name, group_info.get(group_name, [])) for group_name in groups)
     # instances = ['epmprod81']
-    # for instance in instances:
-    #     get_system_update_time(all_fpa_builds, fpa_version, all_epm_builds, epm_version, instance)
+    # targets = dict((instance, [instance]) for instance in instances)
+    # Every wave in the build history, e.g. ('2017.21', '1.00.201721.01')
+    version_pairing = pairing.VersionPairing(file_path + pairing_file)
+    version_pairing.update(open_store(fpa_store_file, builds.FPA))
+    version_pairing.update(open_store(epm_store_file, builds.EPM))
+    version_pairing.save()
+    waves = version_pairing.pairs()
+    # waves = [('2017.21', '1.00.201721.01')]
+
+    with instrument.span('analyze', waves=len(waves), targets=len(targets)):
+        report = analysis.analyze(open_store(fpa_store_file, builds.FPA), open_store(epm_store_file, builds.EPM),
+                                  targets, waves, sampler=sampler)
+    write_json_to_file(report, 'update report.json')
+
+    for fpa_version, epm_version in waves:
+        for name in sorted(report[fpa_version]):
+            result = report[fpa_version][name]
+            if result['minutes'] is None:
+                print name + ": Cannot find any build"
+            else:
+                print("Total " + name + " update time for wave " + fpa_version + ": {} min"
+                      .format(result['minutes']))
+
+    # Unfinished update of the newest wave
+    if waves:
+        fpa_version, epm_version = waves[-1]
+        fpa_index = load_index(fpa_store_file, builds.FPA)
+        epm_index = load_index(epm_store_file, builds.EPM)
+        for group_name in groups:
+            detect_unfinished_update(fpa_index, fpa_version, epm_index, epm_version, group_name)
+        fpa_table = load_table(fpa_store_file, builds.FPA)
+        epm_table = load_table(epm_store_file, builds.EPM)
+        for group_name in groups:
+            get_group_timeline(fpa_table, fpa_version, epm_table, epm_version, group_name)
+
+    if report_history:
+        fpa_table = load_table(fpa_store_file, builds.FPA)
+        epm_table = load_table(epm_store_file, builds.EPM)
+        history = analysis.history_report(fpa_table, epm_table, group_info)
+        write_json_to_file(history, 'history report.json')
+        for group_name in sorted(history['groups']):
+            statistics = history['groups'][group_name]
+            print("{}: {} waves, median {} min, p90 {} min, trend {} min per wave".format(
+                group_name, statistics['waves'], statistics['p50'], statistics['p90'], statistics['trend']))
+
+    if watch_mode and waves:
+        watch(fpa_index, epm_index, version_pairing, groups)
+
+    if instrumentation:
+        for job, query in ((epm_job, epm_query), (fpa_job, fpa_query)):
+            sizes = jenkins.measure_query(job, username, password, query)
+            print("{}: {} bytes per {} builds instead of {} ({} decoded instead of {})".format(
+                job, sizes['query']['received'], jenkins.page_size, sizes['legacy']['received'],
+                sizes['query']['decoded'], sizes['legacy']['decoded']))
+        instrument.write_trace(file_path + trace_file)
+        instrument.write_prometheus(file_path + metrics_file)
+        for stage, total in sorted(instrument.summary().items()):
+            print("{}: {} calls, {:.3f} s, {} bytes, {} records".format(
+                stage, total['calls'], total['seconds'], total['bytes'], total['records']))
 
     print("Total execution time: {} s".format(int(time.time() - execution_start)))
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import urllib
+import urllib2
+import hashlib
+import httplib
+import StringIO
+import threading
+
+
+class HttpCache(object):
+    # Keeps the body and validators (ETag, Last-Modified) of GET responses on disk and revalidates
+    # them with If-None-Match / If-Modified-Since. A 304 answer is served from disk, so an unchanged
+    # resource costs one round trip without a body. Responses without validators are not kept.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    def path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url).hexdigest())
+
+    def lookup(self, url):
+        path = self.path(url)
+        if not os.path.exists(path + '.meta') or not os.path.exists(path + '.body'):
+            return None
+        try:
+            with open(path + '.meta') as meta_file:
+                meta = json.load(meta_file)
+        except ValueError:
+            return None
+        return meta if meta['url'] == url else None
+
+    def open(self, request, fetch):
+        # Sends request through fetch (urllib2.urlopen or an opener's open) with the validators of
+        # the cached response and returns a urllib2 style response either way
+        if request.get_method() != 'GET':
+            return fetch(request)
+        url = request.get_full_url()
+        meta = self.lookup(url)
+        if meta is not None:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            response = fetch(request)
+        except urllib2.HTTPError as e:
+            if e.code != 304 or meta is None:
+                raise
+            if e.fp is not None:
+                e.close()
+            with self.lock:
+                self.hits += 1
+            headers = httplib.HTTPMessage(StringIO.StringIO(meta['headers']))
+            return urllib.addinfourl(open(self.path(url) + '.body', 'rb'), headers, url, 200)
+
+        with self.lock:
+            self.misses += 1
+        etag = response.info().getheader('ETag')
+        last_modified = response.info().getheader('Last-Modified')
+        if response.getcode() != 200 or not (etag or last_modified):
+            return response
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': ''.join(response.info().headers),
+            'fetched': time.time(),
+        }
+        return CachingResponse(response, self, meta)
+
+    def store(self, meta, body_file):
+        # The body is complete, put it in place before the validators that refer to it
+        path = self.path(meta['url'])
+        for name in (path + '.body', path + '.meta'):
+            if os.path.exists(name):
+                os.remove(name)
+        os.rename(body_file, path + '.body')
+        with open(path + '.meta', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        with self.lock:
+            self.stored += 1
+
+    def get_metrics(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stored': self.stored}
+
+
+class CachingResponse(object):
+    # Copies the body to the cache while the caller reads it, the entry is only stored once the
+    # body was read to the end, so a response abandoned half way never ends up in the cache
+
+    def __init__(self, response, cache, meta):
+        self.response = response
+        self.cache = cache
+        self.meta = meta
+        self.body_file = '{}.{}.tmp'.format(cache.path(meta['url']), threading.current_thread().ident)
+        self.body = open(self.body_file, 'wb')
+
+    def read(self, size=-1):
+        data = self.response.read() if size is None or size < 0 else self.response.read(size)
+        if self.body is not None:
+            self.body.write(data)
+            if not data or size is None or size < 0:
+                self.body.close()
+                self.body = None
+                self.cache.store(self.meta, self.body_file)
+        return data
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+            os.remove(self.body_file)
+        self.response.close()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, spans carry no peak memory there
+    resource = None
+
+# Spans are only recorded while enabled, otherwise span() hands out a shared object that does nothing
+enabled = False
+
+# Finished spans in the order they ended
+spans = []
+lock = threading.Lock()
+local = threading.local()
+
+
+def peak_memory():
+    # Peak resident size of the process so far in KB (bytes on OS X), None where it is unknown
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class NullSpan(object):
+    # Stands in for a span while instrumentation is disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, records=0, bytes=0):
+        pass
+
+    def wrap(self, stream):
+        return stream
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    # One pipeline stage: how long it took, how many bytes and records went through it
+    # and the peak memory of the process when it ended. Finished spans only hold plain
+    # values, so worker processes can send theirs back to be merged.
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.records = 0
+        self.bytes = 0
+        self.error = None
+
+    def __enter__(self):
+        stack = getattr(local, 'stack', None)
+        if stack is None:
+            stack = local.stack = []
+        self.parent = stack[-1].stage if stack else None
+        stack.append(self)
+        thread = threading.current_thread()
+        self.pid = os.getpid()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.time() - self.start
+        self.peak_memory = peak_memory()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        local.stack.pop()
+        with lock:
+            spans.append(self)
+        return False
+
+    def add(self, records=0, bytes=0):
+        self.records += records
+        self.bytes += bytes
+
+    def wrap(self, stream):
+        # Counts the bytes read from a file-like object in this span
+        return CountingStream(stream, self)
+
+
+class CountingStream(object):
+
+    def __init__(self, stream, span):
+        self.stream = stream
+        self.span = span
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.span.bytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def span(stage, **labels):
+    # with instrument.span('fetch', job=job) as s: ... s.add(records=n, bytes=m)
+    if not enabled:
+        return NULL_SPAN
+    return Span(stage, labels)
+
+
+def reset():
+    with lock:
+        del spans[:]
+
+
+def take():
+    # Removes and returns the finished spans, e.g. those of a task in a worker process
+    with lock:
+        taken = spans[:]
+        del spans[:]
+    return taken
+
+
+def merge(other):
+    # Adds the spans taken in another process
+    with lock:
+        spans.extend(other)
+
+
+def write_trace(path):
+    # Chrome trace event format, opens in chrome://tracing or Perfetto
+    with lock:
+        events = [{
+            'name': s.stage,
+            'cat': s.parent or s.stage,
+            'ph': 'X',
+            'ts': int(s.start * 1e6),
+            'dur': int(s.duration * 1e6),
+            'pid': s.pid,
+            'tid': s.thread_id,
+            'args': dict(s.labels, records=s.records, bytes=s.bytes, peak_memory=s.peak_memory, error=s.error,
+                         thread=s.thread_name),
+        } for s in spans]
+    with open(path, 'w') as trace:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+
+
+def summary():
+    # Totals per stage: calls, errors, seconds, bytes, records and the highest peak memory
+    totals = {}
+    with lock:
+        for s in spans:
+            total = totals.setdefault(s.stage, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0,
+                                                'records': 0, 'peak_memory': None})
+            total['calls'] += 1
+            total['errors'] += s.error is not None
+            total['seconds'] += s.duration
+            total['bytes'] += s.bytes
+            total['records'] += s.records
+            if s.peak_memory is not None:
+                total['peak_memory'] = max(total['peak_memory'], s.peak_memory)
+    return totals
+
+
+def write_prometheus(path, prefix='wave_update'):
+    # Prometheus text exposition format, e.g. for the node exporter textfile collector
+    totals = summary()
+    metrics = [
+        ('stage_calls_total', 'counter', 'Number of times the stage ran', 'calls'),
+        ('stage_errors_total', 'counter', 'Number of times the stage failed', 'errors'),
+        ('stage_seconds_total', 'counter', 'Time spent in the stage', 'seconds'),
+        ('stage_bytes_total', 'counter', 'Bytes transferred in the stage', 'bytes'),
+        ('stage_records_total', 'counter', 'Records processed in the stage', 'records'),
+        ('stage_peak_memory_kilobytes', 'gauge', 'Peak resident memory of the process after the stage',
+         'peak_memory'),
+    ]
+    lines = []
+    for name, kind, help_text, key in metrics:
+        lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+        lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+        for stage in sorted(totals):
+            if totals[stage][key] is not None:
+                lines.append('{}_{}{{stage="{}"}} {}'.format(prefix, name, stage, totals[stage][key]))
+    with open(path, 'w') as metrics_file:
+        metrics_file.write('\n'.join(lines) + '\n')
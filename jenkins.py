@@ -0,0 +1,266 @@
+import json
+import zlib
+import base64
+import httplib
+import urllib2
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import instrument
+
+JENKINS_URL = 'https://vandevopsjenkins01.pgdev.sap.corp'
+
+# The query every fetch used before BuildQuery, kept to measure what a narrower query saves
+BUILD_TREE = 'allBuilds[number,timestamp,duration,actions[parameters[name,value]]]'
+LEGACY_QUERY = 'depth=2&pretty=true&tree=' + BUILD_TREE
+
+# What a build record needs, see builds.normalize_build
+BUILD_FIELDS = ('number', 'timestamp', 'duration')
+BUILD_PARAMETERS = ('INSTANCE', 'EPM_VERSION', 'FPA_DU_DIR')
+
+# allBuilds is downloaded in windows of page_size positions by up to max_workers threads,
+# a window that fails is retried up to max_retries times before the fetch gives up
+page_size = 200
+max_workers = 4
+max_retries = 3
+
+# Responses are parsed while they arrive, chunk_size bytes at a time
+chunk_size = 64 * 1024
+
+decoder = json.JSONDecoder()
+
+# Optional httpcache.HttpCache, GET requests are then revalidated instead of downloaded again
+http_cache = None
+
+
+def job_url(job):
+    return JENKINS_URL + '/job/Cloud/job/' + job + '/api/json'
+
+
+class GzipStream(object):
+    # Decompresses a gzip encoded response while it is read, compressed counts the bytes received
+
+    def __init__(self, response):
+        self.response = response
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buf = ''
+        self.eof = False
+        self.compressed = 0
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.buf) < size):
+            chunk = self.response.read(chunk_size)
+            self.compressed += len(chunk)
+            if chunk:
+                self.buf += self.decompressor.decompress(chunk)
+            else:
+                self.buf += self.decompressor.flush()
+                self.eof = True
+        if size is None or size < 0:
+            data, self.buf = self.buf, ''
+        else:
+            data, self.buf = self.buf[:size], self.buf[size:]
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+def open_url(url, username, password):
+    request = urllib2.Request(url)
+    base64string = base64.b64encode('%s:%s' % (username, password))
+    request.add_header("Authorization", "Basic %s" % base64string)
+    # The JSON compresses very well, a cached response stays compressed on disk
+    request.add_header("Accept-Encoding", "gzip")
+    if http_cache is not None:
+        response = http_cache.open(request, urllib2.urlopen)
+    else:
+        response = urllib2.urlopen(request)
+    if response.info().getheader("Content-Encoding") == "gzip":
+        return GzipStream(response)
+    return response
+
+
+def get_json(url, username, password):
+    result = open_url(url, username, password)
+    return json.loads(result.read().decode())
+
+
+class BuildQuery(object):
+    # The job parameters a fetch needs. The tree= expression only asks Jenkins for BUILD_FIELDS, the
+    # fields the build store keeps, and for actions only if parameters are needed at all. Jenkins can
+    # not select parameters by name, so the ones not asked for (e.g. SAP_PASSWORD) are dropped by
+    # project() as soon as a build is decoded.
+
+    def __init__(self, parameters=BUILD_PARAMETERS):
+        self.parameters = frozenset(parameters)
+
+    def tree(self, window=None):
+        # window is a (start, end) pair of positions in allBuilds, newest build first, end exclusive
+        fields = list(BUILD_FIELDS)
+        if self.parameters:
+            fields.append('actions[parameters[name,value]]')
+        tree = 'allBuilds[' + ','.join(fields) + ']'
+        if window is not None:
+            tree += '{%d,%d}' % window
+        return tree
+
+    def url(self, job, window=None):
+        # Neither depth (tree= decides what is returned) nor pretty printing is needed
+        return job_url(job) + '?tree=' + self.tree(window)
+
+    def project(self, build):
+        actions = []
+        for action in build.get('actions', ()):
+            parameters = [param for param in action.get('parameters', ()) if param.get('name') in self.parameters]
+            if parameters:
+                actions.append({'parameters': parameters})
+        build['actions'] = actions
+        return build
+
+
+default_query = BuildQuery()
+
+
+def open_builds(job, username, password, window=None, query=default_query):
+    return open_url(query.url(job, window), username, password)
+
+
+def measure_query(job, username, password, query=default_query, window=(0, page_size)):
+    # Downloads one window with the legacy query and with `query` and returns the bytes of both,
+    # as received (compressed when the server gzips) and decoded
+    sizes = {}
+    for name, url in (('legacy', job_url(job) + '?' + LEGACY_QUERY + '{%d,%d}' % window),
+                      ('query', query.url(job, window))):
+        result = open_url(url, username, password)
+        decoded = len(result.read())
+        sizes[name] = {'received': getattr(result, 'compressed', decoded), 'decoded': decoded}
+    sizes['saved'] = dict((key, sizes['legacy'][key] - sizes['query'][key]) for key in ('received', 'decoded'))
+    return sizes
+
+
+def iter_builds(stream, key='allBuilds'):
+    # Yields the elements of the `key` array one at a time while reading the stream,
+    # so only the build being decoded is held in memory
+    buf = ''
+    pos = -1
+    eof = False
+    while pos < 0:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise ValueError("No '{}' array in response".format(key))
+        buf += chunk
+        pos = buf.find('"' + key + '"')
+    pos += len(key) + 2
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n:,[':
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos >= len(buf):
+                raise ValueError('Need more data')
+            build, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+        else:
+            yield build
+
+
+def get_build_range(job, username, password):
+    # firstBuild is the oldest build Jenkins still keeps, so this bounds the size of allBuilds
+    result = get_json(job_url(job) + '?tree=firstBuild[number],lastBuild[number]', username, password)
+    if result.get('lastBuild') is None:
+        return 0, 0
+    return result['firstBuild']['number'], result['lastBuild']['number']
+
+
+def get_windows(start, end, size):
+    return [(i, min(i + size, end)) for i in range(start, end, size)]
+
+
+def fetch_window(args):
+    # process is applied to every build as soon as it is decoded
+    job, username, password, window, process, query = args
+    for attempt in range(max_retries + 1):
+        try:
+            with instrument.span('fetch', job=job, window=window, attempt=attempt) as span:
+                # Bytes are counted as received, before decompression
+                result = open_builds(job, username, password, window, query)
+                if not isinstance(result, GzipStream):
+                    result = span.wrap(result)
+                page = [process(query.project(build)) for build in iter_builds(result)]
+                # Read the rest of the document too, a cached response is only kept once complete
+                result.read()
+                span.add(records=len(page), bytes=getattr(result, 'compressed', 0))
+            return page
+        except (IOError, ValueError, httplib.HTTPException) as e:
+            error = e
+    raise error
+
+
+def iter_windows(job, username, password, windows, process, query):
+    # Windows are downloaded concurrently but yielded in order, at most
+    # twice the pool size of them are held in memory at once
+    pool = ThreadPool(max(1, min(max_workers, len(windows))))
+    pending = deque()
+    try:
+        for window in windows:
+            pending.append(pool.apply_async(fetch_window, ((job, username, password, window, process, query),)))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def fetch_builds(job, username, password, since=1, process=lambda build: build, query=default_query):
+    # Yields every build numbered `since` or later, newest first, with the fields and parameters of query
+    first, last = get_build_range(job, username, password)
+    lowest = max(since, first)
+    if last < lowest:
+        return
+
+    # Build numbers only grow, so the newest (last - lowest + 1) positions cover
+    # every build numbered `lowest` or later, even if some were deleted
+    end = last - lowest + 1
+    seen = set()
+    oldest = None
+    for page in iter_windows(job, username, password, get_windows(0, end, page_size), process, query):
+        for build in page:
+            if build['number'] >= since and build['number'] not in seen:
+                seen.add(build['number'])
+                yield build
+        if page:
+            oldest = page[-1]['number']
+
+    # Builds started during the fetch shift older ones to later positions,
+    # keep reading past the end until the lowest wanted build shows up
+    while oldest is not None and oldest > lowest:
+        page = fetch_window((job, username, password, (end, end + page_size), process, query))
+        end += page_size
+        oldest = page[-1]['number'] if page else None
+        for build in page:
+            if build['number'] >= since and build['number'] not in seen:
+                seen.add(build['number'])
+                yield build
+
+
+def find_sync_point(builds):
+    # Builds still running have duration 0, so they have to be fetched again together with the new ones
+    newest = 0
+    running = []
+    for build in builds:
+        newest = max(newest, build['number'])
+        if build['duration'] == 0:
+            running.append(build['number'])
+    return min(running + [newest + 1])
+
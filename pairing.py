@@ -0,0 +1,84 @@
+import os
+import json
+
+import numpy as np
+
+import builds
+
+
+class VersionPairing(object):
+    # Counts the builds of every FPA and EPM version in the build stores and pairs the versions
+    # of each wave, e.g. FPA '2017.21' with EPM '1.00.201721.01'. The counts are kept in
+    # cache_file together with how far each store was read, so an update only reads the
+    # records appended since the last one.
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.jobs = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as cache:
+                self.jobs = json.load(cache)
+
+    def save(self):
+        with open(self.cache_file + '.tmp', 'w') as cache:
+            json.dump(self.jobs, cache)
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rename(self.cache_file + '.tmp', self.cache_file)
+
+    def read_so_far(self, records, job):
+        # A store that was rewritten (dropped builds, compaction) no longer ends in the
+        # record read last, then it has to be counted from the start
+        position = job['position']
+        if position == 0:
+            return True
+        if len(records) < position:
+            return False
+        last = records[position - 1]
+        return [int(last['number']), int(last['timestamp'])] == job['check']
+
+    def update(self, store):
+        # Counts the builds appended to the store since the last update, returns how many
+        records = store.view()
+        job = self.jobs.get(store.kind)
+        if job is None or not self.read_so_far(records, job):
+            job = self.jobs[store.kind] = {'position': 0, 'newest': 0, 'check': None, 'counts': {}}
+
+        # Builds fetched again because they were still running are already counted, every
+        # build up to the newest one read so far is
+        new = records[job['position']:]
+        counted = new[(new['number'] > job['newest']) & (new['version'] >= 0)]
+        numbers, first = np.unique(counted['number'], return_index=True)
+        codes, counts = np.unique(counted['version'][first], return_counts=True)
+        for code, count in zip(codes, counts):
+            version = store.names[code]
+            job['counts'][version] = job['counts'].get(version, 0) + int(count)
+
+        if len(new):
+            job['newest'] = max(job['newest'], int(new['number'].max()))
+        job['position'] = len(records)
+        if len(records):
+            job['check'] = [int(records[-1]['number']), int(records[-1]['timestamp'])]
+        return int(counts.sum())
+
+    def versions(self, kind):
+        # Versions of a job by wave, most built version first
+        waves = {}
+        counts = self.jobs.get(kind, {}).get('counts', {})
+        for version, count in counts.iteritems():
+            wave = builds.wave_of(version, kind)
+            if wave is not None:
+                waves.setdefault(wave, []).append(version)
+        for versions in waves.values():
+            versions.sort(key=lambda version: (counts[version], version), reverse=True)
+        return waves
+
+    def waves(self):
+        # (wave, fpa_version, epm_version) of every wave with builds of both jobs, oldest first.
+        # A wave deploys one FPA version, of its EPM patch versions the most built one wins.
+        fpa = self.versions(builds.FPA)
+        epm = self.versions(builds.EPM)
+        return [(wave, fpa[wave][0], epm[wave][0]) for wave in sorted(set(fpa).intersection(epm))]
+
+    def pairs(self):
+        return [(fpa_version, epm_version) for wave, fpa_version, epm_version in self.waves()]
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import threading
+import collections
+
+# Samples are taken every `interval` seconds from every thread of the process
+default_interval = 0.005
+
+# Innermost (module, function) of a thread parked waiting for work: a lock or condition wait, a queue
+# read or the pool bookkeeping threads. Such threads are not sampled, they would bury the busy ones.
+idle_frames = set([('threading', 'wait'), ('Queue', 'get'), ('queues', 'get'),
+                   ('pool', '_handle_workers'), ('pool', '_handle_results')])
+
+
+class SamplingProfiler(object):
+    # Samples the Python stack of every thread from a background thread and counts the
+    # stacks in collapsed form ("outer;inner;innermost count"), which flamegraph.pl,
+    # speedscope and similar tools read directly. A worker process samples itself with a profiler
+    # of its own, take() there and merge() here bring its stacks into this one.
+
+    def __init__(self, interval=default_interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.labels = {}
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def label(self, frame):
+        # module.function, with the class for methods (cic.CicDaO.getSystemByName), once per code object
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = module + '.' + code.co_name
+            if code.co_argcount and code.co_varnames[0] == 'self':
+                instance = frame.f_locals.get('self')
+                if instance is not None:
+                    label = '{}.{}.{}'.format(module, type(instance).__name__, code.co_name)
+            self.labels[code] = label
+        return label
+
+    def parked(self, frame):
+        code = frame.f_code
+        idle = self.idle.get(code)
+        if idle is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            idle = self.idle[code] = (module, code.co_name) in idle_frames
+        return idle
+
+    def sample(self):
+        # Every thread but this one and the ones parked waiting for work
+        own = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == own or self.parked(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame))
+                frame = frame.f_back
+            stack.reverse()
+            with self.lock:
+                self.stacks[';'.join(stack)] += 1
+        with self.lock:
+            self.samples += 1
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def take(self):
+        # Removes and returns the stacks and number of samples so far
+        with self.lock:
+            taken = self.stacks, self.samples
+            self.stacks = collections.Counter()
+            self.samples = 0
+        return taken
+
+    def merge(self, taken):
+        # Adds what take() returned in another process
+        stacks, samples = taken
+        with self.lock:
+            self.stacks.update(stacks)
+            self.samples += samples
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write('{} {}\n'.format(stack, count))
+
+    def functions(self):
+        # Samples per function: (total, own) where total counts the samples the function was
+        # anywhere on the stack and own the ones it was the innermost frame
+        total = collections.Counter()
+        own = collections.Counter()
+        for stack, count in self.stacks.iteritems():
+            frames = stack.split(';')
+            for label in set(frames):
+                total[label] += count
+            own[frames[-1]] += count
+        return dict((label, (total[label], own[label])) for label in total)
+
+    def top(self, count=20, prefixes=None):
+        # The `count` functions with the most samples, only those whose label starts with one
+        # of `prefixes` if given
+        functions = self.functions()
+        if prefixes is not None:
+            functions = dict((label, samples) for label, samples in functions.iteritems()
+                             if label.startswith(tuple(prefixes)))
+        return sorted(functions.items(), key=lambda item: item[1], reverse=True)[:count]
@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+
+import analysis
+
+
+class UpdateMinutesTest(unittest.TestCase):
+
+    def test_whole_seconds_are_rounded_up(self):
+        self.assertEqual(analysis.update_minutes(0, 60000), 1)
+        self.assertEqual(analysis.update_minutes(0, 61000), 2)
+
+    def test_milliseconds_are_cut_off_first(self):
+        # 60.999 s between the builds, but whole seconds 1 and 61 like fromtimestamp(ms / 1000)
+        self.assertEqual(analysis.update_minutes(1000, 61999), 1)
+        self.assertEqual(analysis.update_minutes(1999, 62000), 2)
+
+    def test_arrays(self):
+        minutes = analysis.update_minutes(np.array([0, 1000]), np.array([61000, 61999]))
+        self.assertEqual(minutes.tolist(), [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
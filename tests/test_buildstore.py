@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import buildstore
+
+
+def record(number, duration=5, instance='epmprod1', version='2017.21'):
+    return {'number': number, 'timestamp': number * 100, 'duration': duration,
+            'instance': instance, 'version': version, 'kind': 'fpa'}
+
+
+def failing(records, after):
+    # Yields `after` records and then fails like a window that ran out of retries
+    for i, r in enumerate(records):
+        if i == after:
+            raise IOError('window failed')
+        yield r
+
+
+class BuildStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'builds')
+        self.store = buildstore.BuildStore(self.path, 'fpa')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def numbers(self, store=None):
+        return [r['number'] for r in (store or self.store).records()]
+
+    def test_replace_and_reopen(self):
+        self.assertEqual(self.store.replace([record(n) for n in range(3, 0, -1)]), 3)
+        reopened = buildstore.BuildStore(self.path, 'fpa')
+        self.assertEqual(reopened.records(), [record(n) for n in range(3, 0, -1)])
+
+    def test_replace_keeps_old_file_until_complete(self):
+        self.store.replace([record(2), record(1)])
+        with self.assertRaises(IOError):
+            self.store.replace(failing([record(5), record(4), record(3)], 2))
+        self.assertEqual(self.numbers(), [2, 1])
+
+    def test_missing_parameters(self):
+        self.store.replace([record(1, instance=None, version=None)])
+        self.assertEqual(self.store.records()[0]['instance'], None)
+
+    def test_sync_replaces_running_build(self):
+        self.store.replace([record(2, duration=0), record(1)])
+        count, dropped = self.store.sync([record(3), record(2, duration=7)], 2)
+        self.assertEqual((count, dropped), (2, set()))
+        self.assertEqual([(r['number'], r['duration']) for r in self.store.records()], [(3, 5), (2, 7), (1, 5)])
+
+    def test_sync_drops_deleted_running_build(self):
+        self.store.replace([record(3, duration=0), record(2, duration=0), record(1)])
+        count, dropped = self.store.sync([record(4), record(2)], 2)
+        self.assertEqual(dropped, set([3]))
+        self.assertEqual(self.numbers(), [4, 2, 1])
+
+    def test_failed_sync_keeps_store_unchanged(self):
+        self.store.replace([record(n) for n in range(200, 0, -1)])
+        with self.assertRaises(IOError):
+            self.store.sync(failing([record(n) for n in range(300, 200, -1)], 40), 201)
+        self.assertEqual(self.numbers(), range(200, 0, -1))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['builds.dat', 'builds.names'])
+        # The next sync starts from the same point and fills the whole range
+        self.store.sync([record(n) for n in range(300, 200, -1)], 201)
+        self.assertEqual(self.numbers(), range(300, 0, -1))
+
+    def test_interrupted_commit_is_finished_by_next_sync(self):
+        self.store.replace([record(n) for n in range(10, 0, -1)])
+        append = buildstore.BuildStore.append
+
+        def partial(store, records):
+            append(store, list(records)[:2])
+            raise IOError('disk gone')
+
+        buildstore.BuildStore.append = partial
+        try:
+            with self.assertRaises(IOError):
+                self.store.sync([record(n) for n in range(20, 10, -1)], 11)
+        finally:
+            buildstore.BuildStore.append = append
+        self.assertTrue(os.path.exists(self.store.pending_file))
+        self.store.sync([], 21)
+        self.assertEqual(self.numbers(), range(20, 0, -1))
+        self.assertFalse(os.path.exists(self.store.pending_file))
+
+    def test_append_drops_cut_off_record(self):
+        self.store.replace([record(1)])
+        with open(self.store.data_file, 'ab') as data:
+            data.write('\0' * (buildstore.RECORD.size // 2))
+        self.store.append([record(2)])
+        self.assertEqual(self.numbers(), [2, 1])
+
+    def test_replace_rewrites_names(self):
+        self.store.replace([record(2, instance='epmprod2'), record(1)])
+        self.store.replace([record(3, instance='epmprod3'), record(1)])
+        with open(self.store.names_file) as names:
+            self.assertEqual(names.read().split(), ['"epmprod3"', '"2017.21"', '"epmprod1"'])
+        self.assertEqual(self.store.records(), [record(3, instance='epmprod3'), record(1)])
+        self.store.append([record(4, instance='epmprod2')])
+        reopened = buildstore.BuildStore(self.path, 'fpa')
+        self.assertEqual([r['instance'] for r in reopened.records()], ['epmprod2', 'epmprod3', 'epmprod1'])
+
+    def test_committed_replace_is_finished_on_open(self):
+        self.store.replace([record(1)])
+        rename = os.rename
+
+        def stop_after_commit(src, dst):
+            if dst == self.store.names_file:
+                raise OSError('killed')
+            rename(src, dst)
+
+        buildstore.os.rename = stop_after_commit
+        try:
+            with self.assertRaises(OSError):
+                self.store.replace([record(2, instance='epmprod2')])
+        finally:
+            buildstore.os.rename = rename
+        reopened = buildstore.BuildStore(self.path, 'fpa')
+        self.assertEqual(reopened.records(), [record(2, instance='epmprod2')])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['builds.dat', 'builds.names'])
+
+    def test_uncommitted_replace_is_dropped_on_open(self):
+        self.store.replace([record(1)])
+        rename = os.rename
+
+        def stop_before_commit(src, dst):
+            if dst.endswith('.dat.new'):
+                raise OSError('killed')
+            rename(src, dst)
+
+        buildstore.os.rename = stop_before_commit
+        try:
+            with self.assertRaises(OSError):
+                self.store.replace([record(2, instance='epmprod2')])
+        finally:
+            buildstore.os.rename = rename
+        reopened = buildstore.BuildStore(self.path, 'fpa')
+        self.assertEqual(reopened.records(), [record(1)])
+        self.assertEqual(sorted(os.listdir(self.dir)), ['builds.dat', 'builds.names'])
+
+    def test_view_ignores_superseded_records(self):
+        # Build 2 was running on epmprod2 when first fetched, and later restarted on epmprod1
+        self.store.replace([record(2, duration=0, instance='epmprod2'), record(1)])
+        self.store.append([dict(record(2), timestamp=400)])
+        view = buildstore.BuildView(self.store)
+        self.assertEqual(view.first_started('2017.21', ['epmprod2']), None)
+        self.assertEqual(view.first_started('2017.21'), 100)
+        self.assertEqual(view.last_finished('2017.21'), 405)
+
+    def test_view(self):
+        self.store.replace([record(2), record(1, instance='epmprod2')])
+        view = buildstore.BuildView(self.store)
+        self.assertEqual(view.first_started('2017.21'), 100)
+        self.assertEqual(view.last_finished('2017.21', ['epmprod1']), 205)
+        self.assertEqual(view.first_started('2017.22'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
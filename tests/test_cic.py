@@ -0,0 +1,149 @@
+import os
+import shutil
+import urllib2
+import tempfile
+import unittest
+import cookielib
+import threading
+import BaseHTTPServer
+
+import cic
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.dir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_values_are_copied(self):
+        cache = cic.MetadataCache(self.cacheFile)
+        value = [{'name': 'epmprod1', 'groups': ['Group1-EU']}]
+        cache.put('/instances', None, value)
+        value[0]['groups'].append('changed by caller')
+        cached = cache.get('/instances')
+        self.assertEqual(cached, [{'name': 'epmprod1', 'groups': ['Group1-EU']}])
+        cached.pop()
+        self.assertEqual(len(cache.get('/instances')), 1)
+
+    def test_saved_by_owner(self):
+        cache = cic.MetadataCache(self.cacheFile)
+        cache.put('/instances', {'group': 'G1'}, [1, 2])
+        self.assertFalse(os.path.exists(self.cacheFile))
+        cache.save()
+        self.assertEqual(cic.MetadataCache(self.cacheFile).get('/instances', {'group': 'G1'}), [1, 2])
+
+    def test_expired_entry(self):
+        cache = cic.MetadataCache(self.cacheFile, ttl=-1)
+        cache.put('/instances', None, [1])
+        self.assertEqual(cache.get('/instances'), None)
+
+
+class RedirectHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    redirects = {'/old': (302, '/new'), '/moved': (301, '/old'), '/loop': (302, '/loop'), '/temp': (307, '/new')}
+
+    def respond(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.path in self.redirects:
+            code, location = self.redirects[self.path]
+            self.send_response(code)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = '{} {}'.format(self.command, self.path)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PATCH = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledRedirectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RedirectHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.handler = cic.HttpHandler('user', 'password', self.url, lazyLogin=True, maxConnections=2)
+        self.handler.cookieJar = cookielib.CookieJar()
+        self.handler.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.handler.cookieJar))
+
+    def tearDown(self):
+        self.handler.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def open(self, path, data=None, method=None):
+        request = urllib2.Request(self.url + path, data)
+        if method is not None:
+            request.get_method = lambda: method
+        return self.handler._openPooled(request)
+
+    def test_redirects_are_followed(self):
+        response = self.open('/moved')
+        self.assertEqual(response.read(), 'GET /new')
+        self.assertEqual(response.geturl(), self.url + '/new')
+        self.assertEqual(self.handler.getPoolMetrics()['requests'], 3)
+
+    def test_redirected_patch_becomes_get(self):
+        self.assertEqual(self.open('/old', 'a=1', 'PATCH').read(), 'GET /new')
+
+    def test_temporary_redirect_keeps_only_get(self):
+        self.assertEqual(self.open('/temp').read(), 'GET /new')
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            self.open('/temp', 'a=1', 'PATCH')
+        self.assertEqual(raised.exception.code, 307)
+
+    def test_redirect_loop(self):
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            self.open('/loop')
+        self.assertEqual(raised.exception.code, 302)
+
+
+class AsyncCicDaOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.asyncDaO = cic.AsyncCicDaO('user', 'password', 'http://127.0.0.1:1', maxConcurrency=2)
+
+    def tearDown(self):
+        self.asyncDaO.close()
+
+    def test_every_public_method_is_wrapped(self):
+        names = [name for name in dir(cic.CicDaO) if not name.startswith('_') and callable(getattr(cic.CicDaO, name))]
+        self.assertIn('hasPrivilege', names)
+        for name in names:
+            self.assertTrue(callable(getattr(self.asyncDaO, name)), name)
+
+    def test_call_returns_async_result(self):
+        self.asyncDaO.cicDaO.getLandscapesByGroup = lambda groupName: [groupName]
+        self.asyncDaO.cicDaO.hasPrivilege = lambda privilege, groupid=None: (privilege, groupid)
+        results = cic.gatherResults([self.asyncDaO.getLandscapesByGroup('G1'),
+                                     self.asyncDaO.hasPrivilege('admin', groupid=3)])
+        self.assertEqual([result.value for result in results], [['G1'], ('admin', 3)])
+
+    def test_errors_are_raised_by_get(self):
+        def fail(groupname, listofroles, fieldselector=None):
+            raise RuntimeError("no such group", "CIC_GROUP_NOT_FOUND_ERR")
+        self.asyncDaO.cicDaO.getCicMemberList = fail
+        with self.assertRaises(RuntimeError) as raised:
+            self.asyncDaO.getCicMemberList('G1', ['admin']).get(5)
+        self.assertEqual(raised.exception.args[1], "CIC_GROUP_NOT_FOUND_ERR")
+
+    def test_private_and_unknown_names(self):
+        for name in ('_fanOut', 'noSuchMethod', 'metadataCache'):
+            self.assertFalse(hasattr(self.asyncDaO, name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import builds
+import jenkins
+import buildstore
+import getWaveUpdateTime
+
+
+def build(number, instance, du_dir):
+    return {'number': number, 'timestamp': number * 100, 'duration': 5, 'actions': [
+        {'parameters': [{'name': 'INSTANCE', 'value': instance}, {'name': 'FPA_DU_DIR', 'value': du_dir}]}]}
+
+
+class ImportJsonLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_path = getWaveUpdateTime.file_path
+        getWaveUpdateTime.file_path = self.dir + os.sep
+        self.store = buildstore.BuildStore(os.path.join(self.dir, 'fpa builds'), builds.FPA)
+
+    def tearDown(self):
+        getWaveUpdateTime.file_path = self.file_path
+        shutil.rmtree(self.dir)
+
+    def write_log(self, log_file, build_list):
+        with open(os.path.join(self.dir, log_file), 'w') as log:
+            json.dump({'allBuilds': build_list}, log)
+
+    def test_imports_first_log_found(self):
+        self.write_log('fpa log - origin.json', [build(2, 'epmprod1', 'du/2017.21'), build(1, 'epmprod2', 'du/2017.21')])
+        count = getWaveUpdateTime.import_json_log(self.store, ['fpa log.json', 'fpa log - origin.json'])
+        self.assertEqual(count, 2)
+        self.assertEqual([(r['number'], r['instance'], r['version']) for r in self.store.records()],
+                         [(2, 'epmprod1', '2017.21'), (1, 'epmprod2', '2017.21')])
+
+    def test_existing_store_is_kept(self):
+        self.store.replace([builds.normalize_build(build(3, 'epmprod1', 'du/2017.22'), builds.FPA)])
+        self.write_log('fpa log.json', [build(2, 'epmprod1', 'du/2017.21')])
+        self.assertEqual(getWaveUpdateTime.import_json_log(self.store, ['fpa log.json']), 0)
+        self.assertEqual([r['number'] for r in self.store.records()], [3])
+
+    def test_no_log(self):
+        self.assertEqual(getWaveUpdateTime.import_json_log(self.store, ['fpa log.json']), 0)
+        self.assertFalse(self.store.exists())
+
+
+def record(number, duration=5, instance='epmprod1'):
+    return {'number': number, 'timestamp': number * 100, 'duration': duration,
+            'instance': instance, 'version': '2017.21', 'kind': builds.FPA}
+
+
+class GetAllBuildsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = buildstore.BuildStore(os.path.join(self.dir, 'fpa builds'), builds.FPA)
+        self.store.replace([record(2, duration=0), record(1)])
+        self.index = builds.BuildIndex(self.store.records())
+        self.fetch_builds = jenkins.fetch_builds
+
+    def tearDown(self):
+        jenkins.fetch_builds = self.fetch_builds
+        shutil.rmtree(self.dir)
+
+    def fetch(self, fetched, fail_after=None):
+        def fetch_builds(job, username, password, since=1, process=None, query=None):
+            for i, build in enumerate(fetched):
+                if i == fail_after:
+                    raise IOError('window failed')
+                yield build
+        jenkins.fetch_builds = fetch_builds
+
+    def test_index_follows_the_store(self):
+        self.fetch([record(3), record(2, duration=7)])
+        self.assertEqual(getWaveUpdateTime.get_all_builds('job', self.store, self.index), 2)
+        self.assertEqual(sorted((n, r['duration']) for n, r in self.index.by_number.items()),
+                         [(1, 5), (2, 7), (3, 5)])
+
+    def test_failed_fetch_leaves_the_index_unchanged(self):
+        self.fetch([record(4), record(3), record(2, duration=7)], fail_after=2)
+        with self.assertRaises(IOError):
+            getWaveUpdateTime.get_all_builds('job', self.store, self.index)
+        self.assertEqual(sorted((n, r['duration']) for n, r in self.index.by_number.items()), [(1, 5), (2, 0)])
+        self.assertEqual([r['number'] for r in self.store.records()], [2, 1])
+
+    def test_dropped_build_leaves_the_index(self):
+        self.fetch([record(3)])
+        getWaveUpdateTime.get_all_builds('job', self.store, self.index)
+        self.assertEqual(sorted(self.index.by_number), [1, 3])
+
+
+class GroupWithoutInstancesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.group_info = getWaveUpdateTime.group_info
+        getWaveUpdateTime.group_info = {'Group1-EU': ['epmprod1']}
+
+    def tearDown(self):
+        getWaveUpdateTime.group_info = self.group_info
+
+    def test_no_instances(self):
+        index = builds.BuildIndex([record(1)])
+        self.assertEqual(getWaveUpdateTime.detect_unfinished_update(index, '2017.21', index, '1.00', 'Group3-AP'),
+                         None)
+        self.assertEqual(getWaveUpdateTime.get_group_timeline(None, '2017.21', None, '1.00', 'Group3-AP'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import StringIO
+
+import jenkins
+
+
+class ChunkedStream(object):
+    # Hands out at most `size` bytes per read, like a slow response
+
+    def __init__(self, data, size):
+        self.stream = StringIO.StringIO(data)
+        self.size = size
+
+    def read(self, size=-1):
+        return self.stream.read(self.size)
+
+
+def document(builds):
+    return json.dumps({'_class': 'hudson.model.FreeStyleProject', 'allBuilds': builds}, ensure_ascii=False)
+
+
+BUILDS = [
+    {'number': 3, 'timestamp': 30, 'duration': 0,
+     'actions': [{}, {'parameters': [{'name': 'INSTANCE', 'value': u'epmprod3'}]}]},
+    {'number': 2, 'timestamp': 20, 'duration': 5, 'actions': [{'parameters': [{'name': 'NOTE', 'value': u'grüße 更新'}]}]},
+    {'number': 1, 'timestamp': 10, 'duration': 5, 'actions': []},
+]
+
+
+class IterBuildsTest(unittest.TestCase):
+
+    def parse(self, data, size):
+        return list(jenkins.iter_builds(ChunkedStream(data, size)))
+
+    def test_whole_document(self):
+        self.assertEqual(self.parse(document(BUILDS).encode('utf-8'), jenkins.chunk_size), BUILDS)
+
+    def test_one_byte_chunks(self):
+        self.assertEqual(self.parse(document(BUILDS).encode('utf-8'), 1), BUILDS)
+
+    def test_split_utf8(self):
+        data = document(BUILDS).encode('utf-8')
+        # Every chunk boundary from 1 to 16 bytes, some of them inside a multi-byte character
+        for size in range(1, 17):
+            self.assertEqual(self.parse(data, size), BUILDS)
+
+    def test_pretty_printed(self):
+        data = json.dumps({'allBuilds': BUILDS}, indent=2)
+        self.assertEqual(self.parse(data, 7), BUILDS)
+
+    def test_empty_array(self):
+        self.assertEqual(self.parse(document([]), 3), [])
+
+    def test_truncated(self):
+        data = document(BUILDS).encode('utf-8')
+        with self.assertRaises(ValueError):
+            self.parse(data[:len(data) // 2], 5)
+
+    def test_missing_array(self):
+        with self.assertRaises(ValueError):
+            self.parse(json.dumps({'builds': []}), 4)
+
+
+class BuildQueryTest(unittest.TestCase):
+
+    def test_tree(self):
+        query = jenkins.BuildQuery(parameters=['INSTANCE'])
+        self.assertEqual(query.tree((0, 200)),
+                         'allBuilds[number,timestamp,duration,actions[parameters[name,value]]]{0,200}')
+        self.assertEqual(jenkins.BuildQuery(parameters=[]).tree(), 'allBuilds[number,timestamp,duration]')
+
+    def test_project_drops_other_parameters(self):
+        query = jenkins.BuildQuery(parameters=['INSTANCE'])
+        build = query.project({'number': 1, 'actions': [
+            {'parameters': [{'name': 'INSTANCE', 'value': 'a'}, {'name': 'SAP_PASSWORD', 'value': 'x'}]}, {}]})
+        self.assertEqual(build['actions'], [{'parameters': [{'name': 'INSTANCE', 'value': 'a'}]}])
+
+
+class SyncPointTest(unittest.TestCase):
+
+    def test_running_builds_are_fetched_again(self):
+        records = [{'number': 5, 'duration': 3}, {'number': 4, 'duration': 0}, {'number': 3, 'duration': 0}]
+        self.assertEqual(jenkins.find_sync_point(records), 3)
+
+    def test_after_newest(self):
+        self.assertEqual(jenkins.find_sync_point([{'number': 5, 'duration': 3}]), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
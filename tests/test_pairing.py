@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import builds
+import buildstore
+import pairing
+
+
+def record(number, version, kind, duration=5):
+    return {'number': number, 'timestamp': number * 100, 'duration': duration,
+            'instance': 'epmprod1', 'version': version, 'kind': kind}
+
+
+class VersionPairingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fpa = buildstore.BuildStore(os.path.join(self.dir, 'fpa'), builds.FPA)
+        self.epm = buildstore.BuildStore(os.path.join(self.dir, 'epm'), builds.EPM)
+        self.cache_file = os.path.join(self.dir, 'pairs.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pairs_most_built_epm_version(self):
+        self.fpa.replace([record(n, '2017.21', builds.FPA) for n in range(3, 0, -1)])
+        self.epm.replace([record(4, '1.00.201721.02', builds.EPM), record(3, '1.00.201721.01', builds.EPM),
+                          record(2, '1.00.201721.01', builds.EPM), record(1, '1.00.201722.01', builds.EPM)])
+        pairs = pairing.VersionPairing(self.cache_file)
+        self.assertEqual(pairs.update(self.fpa), 3)
+        self.assertEqual(pairs.update(self.epm), 4)
+        self.assertEqual(pairs.pairs(), [('2017.21', '1.00.201721.01')])
+
+    def test_incremental_update(self):
+        self.fpa.replace([record(2, '2017.21', builds.FPA, duration=0), record(1, '2017.21', builds.FPA)])
+        pairs = pairing.VersionPairing(self.cache_file)
+        pairs.update(self.fpa)
+        pairs.save()
+
+        # The running build comes back finished, one new build of the next wave
+        self.fpa.sync([record(3, '2017.22', builds.FPA), record(2, '2017.21', builds.FPA)], 2)
+        pairs = pairing.VersionPairing(self.cache_file)
+        self.assertEqual(pairs.update(self.fpa), 1)
+        self.assertEqual(pairs.jobs[builds.FPA]['counts'], {'2017.21': 2, '2017.22': 1})
+        self.assertEqual(pairs.update(self.fpa), 0)
+
+    def test_rewritten_store_is_counted_again(self):
+        self.fpa.replace([record(2, '2017.21', builds.FPA), record(1, '2017.21', builds.FPA)])
+        pairs = pairing.VersionPairing(self.cache_file)
+        pairs.update(self.fpa)
+        self.fpa.replace([record(1, '2017.21', builds.FPA)])
+        self.assertEqual(pairs.update(self.fpa), 1)
+        self.assertEqual(pairs.jobs[builds.FPA]['counts'], {'2017.21': 1})
+
+    def test_versions_outside_the_naming_are_ignored(self):
+        self.fpa.replace([record(1, 'trunk', builds.FPA)])
+        self.epm.replace([record(1, '1.00.201721.01', builds.EPM)])
+        pairs = pairing.VersionPairing(self.cache_file)
+        pairs.update(self.fpa)
+        pairs.update(self.epm)
+        self.assertEqual(pairs.pairs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import time
+import Queue
+import unittest
+import threading
+
+import profiler
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def test_parked_threads_are_skipped(self):
+        stop = threading.Event()
+        queue = Queue.Queue()
+        threads = [threading.Thread(target=busy, args=(stop,)), threading.Thread(target=queue.get),
+                   threading.Thread(target=stop.wait)]
+        for thread in threads:
+            thread.start()
+        try:
+            sampler = profiler.SamplingProfiler()
+            time.sleep(0.05)
+            for i in range(20):
+                sampler.sample()
+        finally:
+            stop.set()
+            queue.put(None)
+            for thread in threads:
+                thread.join()
+        stacks, samples = sampler.take()
+        self.assertEqual(samples, 20)
+        self.assertTrue(any(stack.endswith('test_profiler.busy') for stack in stacks), stacks)
+        self.assertFalse([stack for stack in stacks if 'Queue.get' in stack or 'threading.wait' in stack])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import builds
+import buildtable
+import timeline
+
+MINUTE = 60 * 1000
+
+
+def record(number, instance, version, start, duration, kind):
+    return {'number': number, 'timestamp': start, 'duration': duration,
+            'instance': instance, 'version': version, 'kind': kind}
+
+
+def epm_builds(count):
+    # One EPM build of 10 minutes per instance, every 10 minutes, so the stuck threshold is 10 minutes
+    return [record(n, 'epmprod%d' % n, '1.00.201721.01', n * 10 * MINUTE, 10 * MINUTE, builds.EPM)
+            for n in range(count)]
+
+
+def fpa_builds(count):
+    return [record(n, 'epmprod%d' % n, '2017.21', (n + 1) * 10 * MINUTE, 10 * MINUTE, builds.FPA)
+            for n in range(count)]
+
+
+class GroupTimelineTest(unittest.TestCase):
+
+    instances = ['epmprod%d' % n for n in range(30)]
+
+    def timeline(self, epm, fpa, now):
+        return timeline.group_timeline(buildtable.BuildTable.from_records(fpa), '2017.21',
+                                       buildtable.BuildTable.from_records(epm), '1.00.201721.01',
+                                       self.instances, now)
+
+    def test_finished_wave(self):
+        result = self.timeline(epm_builds(25), fpa_builds(25), 1000 * MINUTE)
+        self.assertEqual((result['start'], result['end']), (0, 260 * MINUTE))
+        self.assertEqual(result['open'], [])
+        self.assertEqual(sum(result['phases'].values()), 260 * MINUTE)
+
+    def test_running_build_ends_now(self):
+        now = 300 * MINUTE
+        fpa = fpa_builds(25) + [record(25, 'epmprod25', '2017.21', now - 5 * MINUTE, 0, builds.FPA)]
+        result = self.timeline(epm_builds(25), fpa, now)
+        self.assertEqual(result['end'], now)
+        self.assertEqual(result['open'], [])
+        self.assertEqual(result['critical_path']['instance'], 'epmprod25')
+
+    def test_stale_running_build_is_left_open(self):
+        # A build without a duration since the start of the wave, days before now
+        now = 5 * 24 * 60 * MINUTE
+        epm = epm_builds(25) + [record(25, 'epmprod25', '1.00.201721.01', 30 * MINUTE, 0, builds.EPM)]
+        result = self.timeline(epm, fpa_builds(25), now)
+        self.assertEqual((result['start'], result['end']), (0, 260 * MINUTE))
+        self.assertEqual(result['open'], [{'kind': builds.EPM, 'instance': 'epmprod25', 'number': 25,
+                                           'timestamp': 30 * MINUTE}])
+        self.assertEqual(sum(result['phases'].values()), 260 * MINUTE)
+        self.assertEqual(result['peak_builds'], 2)
+        self.assertEqual(result['critical_path']['instance'], 'epmprod24')
+
+    def test_without_now_running_builds_are_left_out(self):
+        epm = epm_builds(25) + [record(25, 'epmprod25', '1.00.201721.01', 30 * MINUTE, 0, builds.EPM)]
+        result = self.timeline(epm, fpa_builds(25), None)
+        self.assertEqual(result['end'], 260 * MINUTE)
+        self.assertEqual(result['open'], [])
+
+
+class StaleAfterTest(unittest.TestCase):
+
+    def test_few_samples_use_the_whole_job(self):
+        table = buildtable.BuildTable.from_records(
+            epm_builds(25) + [record(30, 'epmprod1', '1.00.201722.01', 0, 20 * MINUTE, builds.EPM)])
+        self.assertEqual(timeline.stale_after(table, '1.00.201721.01'), 10 * MINUTE)
+        self.assertEqual(timeline.stale_after(table, '1.00.201722.01'), 10 * MINUTE)
+
+    def test_no_finished_build(self):
+        table = buildtable.BuildTable.from_records([record(1, 'epmprod1', '1.00.201721.01', 0, 0, builds.EPM)])
+        self.assertEqual(timeline.stale_after(table, '1.00.201721.01'), None)
+        self.assertEqual(timeline.running_since(table, '1.00.201721.01', 100), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
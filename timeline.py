@@ -0,0 +1,169 @@
+import numpy as np
+
+import builds
+import detector
+
+# Idle gaps shorter than this (in ms) are not reported
+min_gap = 5 * 60 * 1000
+
+
+def sweep(starts, ends):
+    # Sorts the start and end events of the intervals [start, end) and returns the event times
+    # with the number of open intervals from each event on. An interval ending when another one
+    # starts does not overlap it, so at equal times ends come first.
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), np.int64), np.full(len(ends), -1, np.int64)))
+    order = np.lexsort((deltas, times))
+    return times[order], np.cumsum(deltas[order])
+
+
+def peak(times, levels):
+    # Highest number of open intervals and the first time it is reached
+    if not len(times):
+        return 0, None
+    i = int(np.argmax(levels))
+    return int(levels[i]), long(times[i])
+
+
+def idle_gaps(times, levels, shortest=min_gap):
+    # (start, end) of the stretches between the first start and the last end without an open interval
+    lengths = np.diff(times)
+    idle = np.flatnonzero((levels[:-1] == 0) & (lengths >= max(shortest, 1)))
+    return [(long(times[i]), long(times[i + 1])) for i in idle]
+
+
+def phases(epm_starts, epm_ends, fpa_starts, fpa_ends):
+    # Splits the time from the first build start to the last build end into stretches with only
+    # EPM builds running, only FPA builds, both and none, in ms
+    starts = np.concatenate((epm_starts, fpa_starts))
+    ends = np.concatenate((epm_ends, fpa_ends))
+    is_epm = np.concatenate((np.ones(len(epm_starts), bool), np.zeros(len(fpa_starts), bool)))
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), np.int64), np.full(len(ends), -1, np.int64)))
+    kinds = np.concatenate((is_epm, is_epm))
+    order = np.lexsort((deltas, times))
+    times, deltas, kinds = times[order], deltas[order], kinds[order]
+    epm_open = np.cumsum(np.where(kinds, deltas, 0))[:-1] > 0
+    fpa_open = np.cumsum(np.where(kinds, 0, deltas))[:-1] > 0
+    lengths = np.diff(times)
+    return {
+        'epm_only': long(lengths[epm_open & ~fpa_open].sum()),
+        'fpa_only': long(lengths[fpa_open & ~epm_open].sum()),
+        'both': long(lengths[epm_open & fpa_open].sum()),
+        'idle': long(lengths[~epm_open & ~fpa_open].sum()),
+    }
+
+
+def stale_after(table, version):
+    # Running time after which a build without a duration no longer counts as running: the stuck
+    # threshold of the detector, the stuck_percentile of the finished builds of the version or,
+    # with fewer than min_samples of them, of the whole job. None without any finished build.
+    finished = table.duration > 0
+    code = table.version_codes.get(version)
+    durations = table.duration[finished & (table.version == code)] if code is not None else []
+    if len(durations) < detector.min_samples:
+        durations = table.duration[finished]
+    return long(np.percentile(durations, detector.stuck_percentile)) if len(durations) else None
+
+
+def running_since(table, version, now):
+    # Earliest start of a build that still counts as running at now, see stale_after
+    threshold = stale_after(table, version)
+    return now - threshold if now is not None and threshold is not None else None
+
+
+def build_rows(table, version, instances=None):
+    rows = np.zeros(len(table), bool)
+    for key in table.select(version, instances):
+        rows[table.key_start[key]:table.key_stop[key]] = True
+    return rows
+
+
+def build_intervals(table, version, instances=None, now=None, since=None):
+    # [start, end) of every build of the version on the instances from a BuildTable. A build still
+    # running (duration 0) ends at now, without now it is left out. So is a stale one started
+    # before since, it would stretch the timeline up to now.
+    rows = build_rows(table, version, instances)
+    starts = table.timestamp[rows]
+    ends = table.finish[rows]
+    running = table.duration[rows] == 0
+    if now is not None:
+        live = running if since is None else running & (starts >= since)
+        keep = ~running | live
+        starts, ends = starts[keep], np.where(live, now, ends)[keep]
+    else:
+        starts, ends = starts[~running], ends[~running]
+    return starts, ends
+
+
+def open_builds(table, version, instances, since, kind):
+    # Builds without a duration started before since, left open by build_intervals
+    if since is None:
+        return []
+    rows = build_rows(table, version, instances) & (table.duration == 0) & (table.timestamp < since)
+    return [{'kind': kind, 'instance': table.instances[instance], 'number': long(number),
+             'timestamp': long(timestamp)}
+            for instance, number, timestamp in zip(table.instance[rows], table.number[rows], table.timestamp[rows])]
+
+
+def update_spans(fpa_table, fpa_ver, epm_table, epm_ver, instances=None, now=None,
+                 fpa_since=None, epm_since=None):
+    # Per instance (first EPM start, last EPM finish, first FPA start, last FPA finish), a phase
+    # the instance has no build for is None. A phase with a build still running finishes at now,
+    # stale ones excluded as in build_intervals.
+    epm = epm_table.instance_spans(epm_ver, instances, now, epm_since)
+    fpa = fpa_table.instance_spans(fpa_ver, instances, now, fpa_since)
+    return dict((instance, epm.get(instance, (None, None)) + fpa.get(instance, (None, None)))
+                for instance in set(epm).union(fpa))
+
+
+def critical_path(spans):
+    # The instance that finished last decides when the group is done, its time is split into the
+    # EPM phase, the wait for FPA and the FPA phase
+    def finish(item):
+        epm_first, epm_last, fpa_first, fpa_last = item[1]
+        return fpa_last if fpa_last is not None else epm_last
+
+    instance, (epm_first, epm_last, fpa_first, fpa_last) = max(spans.iteritems(), key=finish)
+    epm_phase = epm_last - epm_first if epm_first is not None else None
+    fpa_phase = fpa_last - fpa_first if fpa_first is not None else None
+    wait = max(0, fpa_first - epm_last) if epm_first is not None and fpa_first is not None else None
+    return {'instance': instance, 'epm': epm_phase, 'wait': wait, 'fpa': fpa_phase}
+
+
+def group_timeline(fpa_table, fpa_ver, epm_table, epm_ver, instances, now=None):
+    # Timeline of one wave in a group, all times in ms. Returns None if the group has no build.
+    # updates: peak number of instances updating at once (first EPM start to last FPA finish)
+    # builds: peak number of builds running at once and the idle gaps without any build
+    # phases: time with only EPM, only FPA, both or no builds running
+    # critical_path: breakdown of the instance that finished last
+    # open: builds without a duration running longer than the stuck threshold, they are left out
+    # of the builds and phases and do not extend the timeline to now
+    fpa_since = running_since(fpa_table, fpa_ver, now)
+    epm_since = running_since(epm_table, epm_ver, now)
+    spans = update_spans(fpa_table, fpa_ver, epm_table, epm_ver, instances, now, fpa_since, epm_since)
+    if not spans:
+        return None
+    span_starts = np.array([s[0] if s[0] is not None else s[2] for s in spans.values()], np.int64)
+    span_ends = np.array([s[3] if s[3] is not None else s[1] for s in spans.values()], np.int64)
+    peak_updates, peak_updates_at = peak(*sweep(span_starts, span_ends))
+
+    epm_starts, epm_ends = build_intervals(epm_table, epm_ver, instances, now, epm_since)
+    fpa_starts, fpa_ends = build_intervals(fpa_table, fpa_ver, instances, now, fpa_since)
+    times, levels = sweep(np.concatenate((epm_starts, fpa_starts)), np.concatenate((epm_ends, fpa_ends)))
+    peak_builds, peak_builds_at = peak(times, levels)
+
+    return {
+        'instances': len(spans),
+        'start': long(span_starts.min()),
+        'end': long(span_ends.max()),
+        'peak_updates': peak_updates,
+        'peak_updates_at': peak_updates_at,
+        'peak_builds': peak_builds,
+        'peak_builds_at': peak_builds_at,
+        'idle_gaps': idle_gaps(times, levels),
+        'phases': phases(epm_starts, epm_ends, fpa_starts, fpa_ends),
+        'critical_path': critical_path(spans),
+        'open': (open_builds(epm_table, epm_ver, instances, epm_since, builds.EPM) +
+                 open_builds(fpa_table, fpa_ver, instances, fpa_since, builds.FPA)),
+    }